@@ -1,7 +1,9 @@
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 
 from NaiveBayes import *
+from Encoder import CategoricalEncoder
 
 
 def data_cleaning(line):
@@ -10,8 +12,6 @@ def data_cleaning(line):
 
 
 def get_data():
-    categories = None
-
     x = []
     with open("Data/data.txt", "r") as file:
         flag = None
@@ -19,22 +19,10 @@ def get_data():
             if SKIP_FIRST and flag is None:
                 flag = True
                 continue
+            x.append(data_cleaning(line))
 
-            line = data_cleaning(line)
-
-            tmp_x = []
-            if categories is None:
-                line_len = len(line)
-                categories = [{ "flag": 1, _l: 0 } for _l in line]
-            for i, _l in enumerate(line):
-                if _l in categories[i]:
-                    tmp_x.append(categories[i][_l])
-                else:
-                    tmp_x.append(categories[i]["flag"])
-                    categories[i][_l] = categories[i]["flag"]
-                    categories[i]["flag"] += 1
-
-            x.append(tmp_x)
+    encoder = CategoricalEncoder()
+    x = encoder.fit_transform(np.array(x)).tolist()
 
     y = []
     for xx in x:
@@ -45,8 +33,8 @@ def get_data():
     for xx, yy in xy_zip:
         category[yy].append(xx)
 
-    n_possibilities = [_c["flag"] if WHETHER_DISCRETE[i] else PRE_CONFIGURED_FUNCTION[i]
-                       for i, _c in enumerate(categories) if i != TAR_IDX]
+    n_possibilities = [int(_n) if WHETHER_DISCRETE[i] else PRE_CONFIGURED_FUNCTION[i]
+                       for i, _n in enumerate(encoder.n_values) if i != TAR_IDX]
 
     y_data = (xy_zip, category, n_possibilities)
 
@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import importlib.util
+import numpy as np
+import multiprocessing as mp
+
+from sklearn import __version__ as sklearn_version
+from sklearn.tree import DecisionTreeClassifier
+
+from CvDTree import ID3Tree, C45Tree
+
+# Usage: python Benchmark.py [output path (default: Benchmark.json)] [--quick]
+# Results are saved after every config, every model is measured in a forked process (if available)
+
+# Every sweep varies one parameter of BASE_CONFIG
+BASE_CONFIG = {"n_samples": 5000, "n_features": 10, "n_values": 4, "max_depth": None}
+SWEEPS = {
+    "n_samples": [1000, 5000, 20000, 100000],
+    "n_features": [5, 10, 20, 50],
+    "n_values": [2, 4, 16, 64],
+    "max_depth": [3, 6, 10, None]
+}
+QUICK_SWEEPS = {
+    "n_samples": [1000, 5000],
+    "n_features": [5, 10],
+    "n_values": [2, 16],
+    "max_depth": [3, None]
+}
+# The Dev tree predicts row by row & prunes by copying itself, so it is fitted on at most DEV_MAX_SAMPLES rows
+# of every config (points of the n_samples sweep above it are skipped), once without & once with sample weights
+DEV_MAX_SAMPLES = 2000
+TEST_SAMPLES = 5000
+
+
+def load_dev_tree():
+    """ Dev/CvDTree.py shares its module name with CvDTree.py, so it is loaded from its path """
+    _path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Dev", "CvDTree.py")
+    _spec = importlib.util.spec_from_file_location("DevCvDTree", _path)
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module.C45Tree
+
+
+def gen_data(n_samples, n_features, n_values, seed=0):
+    """
+    Categorical data whose labels depend on the first three features, 10% of labels are flipped
+    :return: (x, y) -> integer codes, shape = (n_samples, n_features) & binary labels
+    """
+    _rng = np.random.RandomState(seed)
+    x = _rng.randint(n_values, size=(n_samples, max(3, n_features)))
+    y = (((x[:, 0] >= n_values // 2) & (x[:, 1] < n_values // 2)) | (x[:, 2] == 0)).astype(np.int8)
+    x = x[:, :n_features]
+    _flip = _rng.rand(n_samples) < 0.1
+    y[_flip] = 1 - y[_flip]
+    return x, y
+
+
+def gen_weights(n_samples, seed=1):
+    """ Non-uniform sample weights (summing up to 1), so that the weighted path of the Dev tree is timed """
+    _weights = np.random.RandomState(seed).uniform(0.5, 1.5, n_samples)
+    return _weights / np.sum(_weights)
+
+
+def get_models(max_depth, dev_tree):
+    """ name -> (build, count_nodes, whether fitted with sample weights) """
+    return {
+        "ID3Tree": (lambda: ID3Tree(max_depth), lambda _tree: len(_tree.nodes), False),
+        "C45Tree": (lambda: C45Tree(max_depth), lambda _tree: len(_tree.nodes), False),
+        "DevC45Tree": (lambda: dev_tree(max_depth), lambda _tree: len(_tree.nodes), False),
+        "DevC45Tree-w": (lambda: dev_tree(max_depth), lambda _tree: len(_tree.nodes), True),
+        "sklearn": (
+            lambda: DecisionTreeClassifier(criterion="entropy", max_depth=max_depth),
+            lambda _tree: int(_tree.tree_.node_count), False)
+    }
+
+
+def measure(build, count_nodes, x_train, y_train, x_test, y_test, sample_weight=None):
+    """
+    Fit time, peak traced memory of fitting, predict throughput, node count & test accuracy of one model
+    tracemalloc slows down python code a lot, so peak memory is measured by a second fit
+    """
+    _args = (x_train, y_train) if sample_weight is None else (x_train, y_train, sample_weight)
+    _t = time.perf_counter()
+    _model = build()
+    _model.fit(*_args)
+    _fit_time = time.perf_counter() - _t
+    tracemalloc.start()
+    build().fit(*_args)
+    _peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    _t = time.perf_counter()
+    _y_pred = np.asarray(_model.predict(x_test))
+    _predict_time = time.perf_counter() - _t
+    return {
+        "fit_time": _fit_time,
+        "predict_rows_per_s": len(x_test) / max(_predict_time, 1e-12),
+        "peak_memory_mb": _peak / 2 ** 20,
+        "n_nodes": count_nodes(_model),
+        "acc": float(np.mean(_y_pred.astype(np.int64) == y_test))
+    }
+
+
+def _measure_child(conn, args):
+    try:
+        conn.send(measure(*args))
+    except (RecursionError, MemoryError) as err:
+        conn.send({"error": repr(err)})
+    finally:
+        conn.close()
+
+
+def measure_in_process(*args):
+    """
+    Run 'measure' in a forked process, so that memory of the fitted models (& of tracemalloc) is released
+    after every run, and a process killed e.g. by running out of memory only loses its own result
+    """
+    if "fork" not in mp.get_all_start_methods():
+        try:
+            return measure(*args)
+        except (RecursionError, MemoryError) as err:
+            return {"error": repr(err)}
+    _ctx = mp.get_context("fork")
+    _receiver, _sender = _ctx.Pipe(duplex=False)
+    _process = _ctx.Process(target=_measure_child, args=(_sender, args))
+    _process.start()
+    _sender.close()
+    try:
+        _result = _receiver.recv()
+    except EOFError:
+        _result = None
+    _receiver.close()
+    _process.join()
+    if _result is None:
+        return {"error": "measuring process exited with code {}".format(_process.exitcode)}
+    return _result
+
+
+def run(sweeps, dev_tree, output):
+    results = []
+    for _param, _values in sweeps.items():
+        for _value in _values:
+            _config = dict(BASE_CONFIG, **{_param: _value})
+            x, y = gen_data(_config["n_samples"] + TEST_SAMPLES, _config["n_features"], _config["n_values"])
+            x_train, y_train = x[:_config["n_samples"]], y[:_config["n_samples"]]
+            x_test, y_test = x[_config["n_samples"]:], y[_config["n_samples"]:]
+            for _name, (_build, _count_nodes, _weighted) in get_models(_config["max_depth"], dev_tree).items():
+                _result = dict(_config, sweep=_param, model=_name, weighted=_weighted)
+                _n_train = _config["n_samples"]
+                if _name.startswith("DevC45Tree") and _param == "n_samples" and _n_train > DEV_MAX_SAMPLES:
+                    _result["skipped"] = "n_samples > {}".format(DEV_MAX_SAMPLES)
+                else:
+                    if _name.startswith("DevC45Tree"):
+                        _n_train = _result["n_samples"] = min(_n_train, DEV_MAX_SAMPLES)
+                    _result.update(measure_in_process(
+                        _build, _count_nodes, x_train[:_n_train], y_train[:_n_train], x_test, y_test,
+                        gen_weights(_n_train) if _weighted else None))
+                results.append(_result)
+                print_result(_result)
+            save_results(output, results)
+    return results
+
+
+def check_parallel(n_jobs=2, min_parallel_size=500):
+    """ Subtrees built in the process pool should give the same compiled tree as the sequential build """
+    x, y = gen_data(BASE_CONFIG["n_samples"], BASE_CONFIG["n_features"], BASE_CONFIG["n_values"])
+    _tree, _parallel_tree = C45Tree(), C45Tree()
+    _tree.fit(x, y)
+    _parallel_tree.fit(x, y, n_jobs=n_jobs, min_parallel_size=min_parallel_size)
+    _compiled, _parallel_compiled = _tree.compile(), _parallel_tree.compile()
+    return all(np.array_equal(_compiled[key], _parallel_compiled[key])
+               for key in ("feature", "offset", "table", "split", "node_class"))
+
+
+def save_results(path, results):
+    """ Write results (with environment info) to a temporary file & move it to 'path' """
+    with open(path + ".tmp", "w") as file:
+        json.dump({
+            "meta": {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "sklearn": sklearn_version,
+                "platform": platform.platform(),
+                "base_config": BASE_CONFIG,
+                "test_samples": TEST_SAMPLES
+            },
+            "results": results
+        }, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def print_result(result):
+    _config = "{}={}".format(result["sweep"], result[result["sweep"]])
+    if "fit_time" not in result:
+        print("{:<22s} {:<12s} {}".format(_config, result["model"], result.get("skipped", result.get("error"))))
+        return
+    print("{:<22s} {:<12s} fit: {:9.4f} s  predict: {:12.0f} rows/s  peak: {:8.2f} MB  nodes: {:6d}  acc: {:.4f}".format(
+        _config, result["model"], result["fit_time"], result["predict_rows_per_s"],
+        result["peak_memory_mb"], result["n_nodes"], result["acc"]))
+
+
+if __name__ == '__main__':
+    _args = [_arg for _arg in sys.argv[1:] if not _arg.startswith("--")]
+    _output = _args[0] if _args else "Benchmark.json"
+    _sweeps = QUICK_SWEEPS if "--quick" in sys.argv else SWEEPS
+    print("Parallel build identical: {}".format(check_parallel()))
+    run(_sweeps, load_dev_tree(), _output)
+    print("Results saved to {}".format(_output))
@@ -1,14 +1,21 @@
+import os
 import time
 import math
+import json
+import heapq
+import itertools
 import numpy as np
-from collections import Counter
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import pprint
 
 from sklearn.tree import DecisionTreeClassifier
 
-# TODO: Debug - Pruning, CART Pruning
+from Encoder import CategoricalEncoder, ContinuousEncoder
+
+# TODO: Debug - Pruning
 # TODO: Try batch prediction and visualization
-# TODO: Support Continuous Data ; Feed sample-weight
+# TODO: Feed sample-weight
 
 
 # Util
@@ -16,52 +23,258 @@ from sklearn.tree import DecisionTreeClassifier
 class Cluster:
     def __init__(self, data, labels, base=2):
         self._data = np.array(data).T
-        self._counters = Counter(labels)
         self._labels = np.array(labels)
-        self._cache = None
+        _, self._label_codes = np.unique(self._labels, return_inverse=True)
+        self._label_codes = self._label_codes.ravel()
+        self._counters = np.bincount(self._label_codes)
+        self._codes = self._n_values = None
+        self._tables = None
         self._base = base
 
+    @classmethod
+    def from_codes(cls, codes, label_codes, n_values, n_classes, base=2):
+        """ :param codes: integer-coded features, shape = (n_features, n_samples) """
+        _cluster = cls.__new__(cls)
+        _cluster._data = None
+        _cluster._labels = _cluster._label_codes = label_codes
+        _cluster._counters = np.bincount(label_codes, minlength=n_classes)
+        _cluster._codes, _cluster._n_values = codes, np.asarray(n_values)
+        _cluster._tables = None
+        _cluster._base = base
+        return _cluster
+
+    @classmethod
+    def from_tables(cls, tables, offsets, counters, base=2):
+        """ :param tables: stacked (feature_value x class) tables, see 'get_tables' """
+        _cluster = cls.__new__(cls)
+        _cluster._data = _cluster._labels = _cluster._label_codes = None
+        _cluster._codes = _cluster._n_values = None
+        _cluster._counters = counters
+        _cluster._tables = (tables, offsets)
+        _cluster._base = base
+        return _cluster
+
+    @staticmethod
+    def _ent_rows(counts, base, eps=1e-12):
+        """ Entropy of every row of a count table (last axis = classes) """
+        _total = np.sum(counts, axis=-1, keepdims=True)
+        _p = counts / np.maximum(_total, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            _log_p = np.where(_p > 0, np.log(_p), 0)
+        return np.maximum(eps, -np.sum(_p * _log_p, axis=-1) / math.log(base))
+
+    @staticmethod
+    def _gini_rows(counts):
+        _total = np.sum(counts, axis=-1, keepdims=True)
+        return 1 - np.sum((counts / np.maximum(_total, 1)) ** 2, axis=-1)
+
     def ent(self, ent=None, eps=1e-12):
-        _len = len(self._labels)
         if ent is None:
-            ent = [_val for _val in self._counters.values()]
-        return max(eps, -sum([_c / _len * math.log(_c / _len, self._base) for _c in ent]))
+            ent = self._counters
+        return float(Cluster._ent_rows(np.asarray(ent, dtype=np.float64), self._base, eps))
 
     def gini(self, p=None):
         if p is None:
-            p = [_val for _val in self._counters.values()]
-        return 1 - sum([(_p / len(self._labels)) ** 2 for _p in p])
+            p = self._counters
+        return float(Cluster._gini_rows(np.asarray(p, dtype=np.float64)))
 
-    def con_chaos(self, idx, criteria="ent"):
-        if criteria == "ent":
-            _method = lambda cluster: cluster.ent()
+    def get_tables(self):
+        """ Stacked (feature_value x class) tables of all features & offsets of every feature in them """
+        if self._tables is None:
+            if self._codes is None:
+                self._codes = np.empty(self._data.shape, dtype=np.intp)
+                self._n_values = np.empty(len(self._data), dtype=np.intp)
+                for i, feature in enumerate(self._data):
+                    _values, self._codes[i] = np.unique(feature, return_inverse=True)
+                    self._n_values[i] = len(_values)
+            _n_classes = len(self._counters)
+            _offsets = np.concatenate(([0], np.cumsum(self._n_values)[:-1])).astype(np.intp)
+            _tables = np.empty((np.sum(self._n_values), _n_classes))
+            for _codes, _offset, _n in zip(self._codes, _offsets, self._n_values):
+                _tables[_offset:_offset + _n] = np.bincount(
+                    _codes.astype(np.intp) * _n_classes + self._label_codes, minlength=_n * _n_classes
+                ).reshape(_n, _n_classes)
+            self._tables = (_tables, _offsets)
+        return self._tables
+
+    def info_gains(self, criteria="ent"):
+        """ :return: (gains, con_chaos) -> arrays whose i-th element belongs to feature i """
+        _tables, _offsets = self.get_tables()
+        _len = np.sum(self._counters)
+        _value_counts = np.sum(_tables, axis=1)
+        if criteria in ("ent", "ratio"):
+            _con_chaos = np.add.reduceat(_value_counts * Cluster._ent_rows(_tables, self._base), _offsets) / _len
+            _gains = self.ent() - _con_chaos
+            if criteria == "ratio":
+                _p = _value_counts / _len
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    _p_log_p = np.where(_p > 0, _p * np.log(_p), 0)
+                _split_info = -np.add.reduceat(_p_log_p, _offsets) / math.log(self._base)
+                _gains = np.where(_split_info > 1e-12, _gains / np.maximum(_split_info, 1e-12), 0)
         elif criteria == "gini":
-            _method = lambda cluster: cluster.gini()
+            _con_chaos = np.add.reduceat(_value_counts * Cluster._gini_rows(_tables), _offsets) / _len
+            _gains = self.gini() - _con_chaos
         else:
-            raise NotImplementedError("Conditional info criteria '{}' not defined".format(criteria))
-        data = self._data[idx]
-        features = list(sorted(set(data)))
-        self._cache = tmp_labels = [data == feature for feature in features]
-        label_lst = [self._labels[label] for label in tmp_labels]
-        rs = 0
-        for data_label, tar_label in zip(tmp_labels, label_lst):
-            tmp_data = self._data.T[data_label]
-            _ent = _method(Cluster(tmp_data, tar_label, base=self._base))
-            rs += len(tmp_data) / len(data) * _ent
-        return rs
+            raise NotImplementedError("Info_gain criteria '{}' not defined".format(criteria))
+        return _gains, _con_chaos
 
-    def info_gain(self, idx, criteria="ent", get_con_chaos=False):
+    @staticmethod
+    def sorted_candidates(sorted_codes, sorted_labels, n_classes):
+        """ :return: (left, splits) -> left[i] = class counts of (codes <= splits[i]) """
+        _positions = np.flatnonzero(sorted_codes[1:] != sorted_codes[:-1])
+        _left = np.cumsum(np.eye(n_classes)[sorted_labels], axis=0)[_positions]
+        return _left, sorted_codes[_positions]
+
+    @staticmethod
+    def hist_candidates(hist):
+        """ :return: (left, splits) -> left[i] = class counts of (bins <= splits[i]) """
+        _bins = np.flatnonzero(np.sum(hist, axis=1))[:-1]
+        return np.cumsum(hist, axis=0)[_bins], _bins
+
+    def threshold_gain(self, left, splits, criteria="ent"):
+        """ :return: (gain, con_chaos, split) of the best split (codes <= split), split = None if there's none """
+        if not len(splits):
+            return 0, 0, None
+        _len = np.sum(self._counters)
+        _right = self._counters - left
+        _n_left = np.sum(left, axis=1)
+        _p = _n_left / _len
         if criteria in ("ent", "ratio"):
-            _con_chaos = self.con_chaos(idx)
-            _gain = self.ent() - _con_chaos
-            if criteria == "ratio":
-                _gain = _gain / self.ent([np.sum(_cache) for _cache in self._cache])
+            _con_chaos = (
+                _n_left * Cluster._ent_rows(left, self._base) + (_len - _n_left) * Cluster._ent_rows(_right, self._base)
+            ) / _len
+            _gains = self.ent() - _con_chaos
         elif criteria == "gini":
-            _con_chaos = self.con_chaos(idx, criteria="gini")
-            _gain = self.gini() - _con_chaos
+            _con_chaos = (_n_left * Cluster._gini_rows(left) + (_len - _n_left) * Cluster._gini_rows(_right)) / _len
+            _gains = self.gini() - _con_chaos
         else:
             raise NotImplementedError("Info_gain criteria '{}' not defined".format(criteria))
-        return (_gain, _con_chaos) if get_con_chaos else _gain
+        _arg = int(np.argmax(_gains))
+        _gain = _gains[_arg]
+        if criteria == "ratio":
+            # As in C4.5, the threshold is chosen by info gain and only then normalized by split info
+            _p = _p[_arg]
+            _gain /= -(_p * math.log(_p) + (1 - _p) * math.log(1 - _p)) / math.log(self._base)
+        return _gain, _con_chaos[_arg], int(splits[_arg])
+
+    def con_chaos(self, idx, criteria="ent"):
+        if criteria not in ("ent", "gini"):
+            raise NotImplementedError("Conditional info criteria '{}' not defined".format(criteria))
+        return self.info_gains(criteria)[1][idx]
+
+    def info_gain(self, idx, criteria="ent", get_con_chaos=False):
+        _gains, _con_chaos = self.info_gains(criteria)
+        return (_gains[idx], _con_chaos[idx]) if get_con_chaos else _gains[idx]
+
+
+# Binary format of compiled trees:
+#     magic (8 bytes) | header length (uint64) | json header | raw arrays (each aligned to _ALIGN bytes)
+# header = {"version": ..., "meta": {...}, "arrays": [[name, dtype, shape, offset], ...]}
+
+_MAGIC = b"CVDTREE\x00"
+_VERSION = 2
+_ALIGN = 64
+
+
+def _compact(arr):
+    arr = np.asarray(arr)
+    if arr.dtype.kind != "i":
+        return arr
+    for _dtype in (np.int8, np.int16, np.int32):
+        _info = np.iinfo(_dtype)
+        if not len(arr) or (_info.min <= arr.min() and arr.max() <= _info.max):
+            return arr.astype(_dtype)
+    return arr
+
+
+def _from_object(arr):
+    for _dtype in (np.int64, np.float64):
+        try:
+            _arr = arr.astype(_dtype)
+        except (TypeError, ValueError):
+            continue
+        if np.all(_arr == arr):
+            return _arr
+    return arr.astype(str)
+
+
+def _write_header(file, arrays, meta, object_arrays=()):
+    """ :return: entries of the header & total size of the file """
+    _entries, _size = [], 0
+    for name, dtype, shape in arrays:
+        _entries.append([name, np.dtype(dtype).str, [int(_s) for _s in shape], _size])
+        _size += -(-int(np.prod(shape, dtype=np.intp)) * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+    _header = json.dumps({
+        "version": _VERSION, "meta": meta or {}, "arrays": _entries, "object_arrays": list(object_arrays)
+    }).encode("utf-8")
+    _data_start = -(-(len(_MAGIC) + 8 + len(_header)) // _ALIGN) * _ALIGN
+    file.write(_MAGIC)
+    file.write(np.uint64(len(_header)).tobytes())
+    file.write(_header)
+    return [_entry[:3] + [_data_start + _entry[3]] for _entry in _entries], _data_start + _size
+
+
+def save_arrays(path, arrays, meta=None):
+    """ :param arrays: dict -> {name: numpy array} """
+    _arrays, _object_arrays = {}, []
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        if arr.dtype == object:
+            arr = _from_object(arr)
+            _object_arrays.append(name)
+        _arrays[name] = arr
+    with open(path, "wb") as file:
+        _entries, _size = _write_header(
+            file, [(name, arr.dtype, arr.shape) for name, arr in _arrays.items()], meta, _object_arrays)
+        for (_, _, _, _offset), arr in zip(_entries, _arrays.values()):
+            file.seek(_offset)
+            file.write(arr.tobytes())
+        file.truncate(_size)
+
+
+def create_arrays(path, arrays, meta=None):
+    """ :return: dict -> {name: writable memory-mapped array} """
+    with open(path, "wb") as file:
+        _, _size = _write_header(file, [(name, dtype, shape) for name, (dtype, shape) in arrays.items()], meta)
+        file.truncate(_size)
+    return load_arrays(path, mode="r+")[0]
+
+
+def load_arrays(path, mmap=True, mode="r"):
+    """ :return: (arrays, meta) """
+    with open(path, "rb") as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("'{}' is not a compiled tree file".format(path))
+        _length = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+        _header = json.loads(file.read(_length).decode("utf-8"))
+        if _header["version"] != _VERSION:
+            raise ValueError("Unsupported compiled tree file version: {}".format(_header["version"]))
+        _data_start = -(-(len(_MAGIC) + 8 + _length) // _ALIGN) * _ALIGN
+        _arrays = {}
+        for name, dtype, shape, offset in _header["arrays"]:
+            dtype, shape, offset = np.dtype(dtype), tuple(shape), _data_start + offset
+            if not np.prod(shape, dtype=np.intp):
+                _arrays[name] = np.empty(shape, dtype=dtype)
+            elif mmap:
+                _arrays[name] = np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+                if mode == "r":
+                    _arrays[name] = _arrays[name].view(np.ndarray)
+            else:
+                file.seek(offset)
+                _arrays[name] = np.fromfile(file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        for name in _header.get("object_arrays", []):
+            _arrays[name] = _arrays[name].astype(object)
+    return _arrays, _header["meta"]
+
+
+def read_chunks(path, chunk_size=100000, sep=","):
+    with open(path, "r") as file:
+        while True:
+            _lines = list(itertools.islice(file, chunk_size))
+            if not _lines:
+                return
+            _lines = [line.rstrip("\n") for line in _lines if line.strip()]
+            yield np.array(sep.join(_lines).split(sep)).reshape(len(_lines), -1)
 
 
 # Node
@@ -69,7 +282,9 @@ class Cluster:
 class CvDNode:
     def __init__(self, tree=None, max_depth=None, base=2, ent=None,
                  depth=0, parent=None, is_root=True, prev_feat="Root"):
-        self._data = self.labels = None
+        self._start = self._end = 0
+        self._used_feat = 0
+        self._counts = self._hist = None
         self._max_depth = max_depth
         self._base = base
         self._ent = ent
@@ -81,12 +296,16 @@ class CvDNode:
         if tree is not None:
             tree.nodes.append(self)
         self.feature_dim = None
+        # threshold (and its code) of a binary split on a continuous feature
+        self.threshold = self._split_code = None
         self._depth = depth
         self.parent = parent
         self._is_root = is_root
         self._prev_feat = prev_feat
+        # weight = number of leafs below, leaf_chaos = sum of n_samples * entropy of these leafs,
+        # leaf_error = sum of training errors of these leafs
         self.weight = 0
-        self.leafs = {}
+        self.leaf_chaos = self.leaf_error = 0
         self.pruned = False
 
     def __getitem__(self, item):
@@ -108,36 +327,53 @@ class CvDNode:
     def prev_feat(self):
         return self._prev_feat
 
+    @property
+    def rows(self):
+        return self.tree.indices[self._start:self._end]
+
+    @property
+    def labels(self):
+        return self.tree.label_values[self.tree.y[self.rows]]
+
+    @property
+    def available_features(self):
+        return np.array([
+            i for i in range(self.tree.n_features)
+            if self.tree.whether_continuous[i] or not (self._used_feat >> i) & 1
+        ], dtype=np.intp)
+
     def copy(self):
         _new_node = self.__class__(
             None, self._max_depth, self._base, self._ent,
             self._depth, self.parent, self._is_root, self._prev_feat)
         _new_node.tree = self.tree
         _new_node.feature_dim = self.feature_dim
+        _new_node.threshold, _new_node._split_code = self.threshold, self._split_code
         _new_node.category = self.category
-        _new_node.labels = self.labels
+        _new_node._start, _new_node._end = self._start, self._end
+        _new_node._used_feat, _new_node._counts = self._used_feat, self._counts
         _new_node.pruned = self.pruned
         if self.children:
             for key, node in self.children.items():
                 _new_node.children[key] = node.copy()
         else:
             _new_node.category = self.category
-        if self.leafs:
-            for key, leaf in self.leafs.items():
-                _new_node.leafs[key] = leaf.copy()
+        _new_node.weight, _new_node.leaf_chaos, _new_node.leaf_error = self.weight, self.leaf_chaos, self.leaf_error
         return _new_node
 
     def feed_tree(self, tree):
         self.tree = tree
         self.tree.nodes.append(self)
 
-    def feed_data(self, data, labels):
-        self._data = np.array(data).T
-        self.labels = np.array(labels)
+    def feed_data(self, data, labels, whether_continuous=None, n_bins=None):
+        self.tree.feed_data(data, labels, whether_continuous, n_bins)
+        self._start, self._end = 0, self.tree.n_samples
+        self._used_feat = 0
 
     def stop(self, eps):
         if (
-            self._data.shape[1] == 1 or (self._ent is not None and self._ent <= eps)
+            not len(self.available_features) or self._end - self._start == 1
+            or (self._ent is not None and self._ent <= eps)
             or (self._max_depth is not None and self._depth >= self._max_depth)
         ):
             self._handle_terminate()
@@ -150,88 +386,177 @@ class CvDNode:
             return True
         return False
 
-    def crop(self, x=None):
-        x = self._data if x is None else x
-        _mask = np.ones(len(x), dtype=np.bool)
-        _mask[self.feature_dim] = False
-        return x[_mask]
-
     def get_class(self):
-        _counter = Counter(self.labels)
-        return max(_counter, key=(lambda key: _counter[key]))
+        return self.tree.label_values[np.argmax(self._counts)]
+
+    @property
+    def chaos(self):
+        return (self._end - self._start) * Cluster._ent_rows(self._counts.astype(np.float64), self._base)
+
+    @property
+    def error(self):
+        return self._end - self._start - np.max(self._counts)
 
     def get_threshold(self):
         if self.category is None:
-            rs = 0
-            for leaf in self.leafs.values():
-                _cluster = Cluster(None, leaf, self._base)
-                rs += len(leaf) * _cluster.ent()
-            return Cluster(None, self.labels, self._base).ent() - rs / (self.weight - 1)
+            return self.chaos / (self._end - self._start) - self.leaf_chaos / (self.weight - 1)
+        return 0
+
+    def get_alpha(self):
+        """ CART cost-complexity: the alpha at which collapsing current node costs nothing """
+        if self.category is None:
+            return (self.error - self.leaf_error) / (self.weight - 1)
         return 0
 
-    def _gen_children(self, features, new_data, con_chaos):
-        for feat in set(features):
-            _feat_mask = features == feat
+    def _child_codes(self, rows):
+        _codes = self.tree.x[self.feature_dim][rows]
+        if self._split_code is not None:
+            return (_codes > self._split_code).astype(np.intp)
+        return _codes
+
+    def _child_keys(self):
+        if self._split_code is not None:
+            return [0, 1], ["<= {:.6g}".format(self.threshold), "> {:.6g}".format(self.threshold)]
+        return self.tree.feature_values[self.feature_dim], self.tree.feature_values[self.feature_dim]
+
+    def _add_children(self, bounds, con_chaos):
+        _new_nodes = []
+        for _code, (key, feat) in enumerate(zip(*self._child_keys())):
+            if bounds[_code] == bounds[_code + 1]:
+                continue
             _new_node = self.__class__(
                 self.tree, self._max_depth, self._base, ent=con_chaos,
                 depth=self._depth + 1, parent=self, is_root=False, prev_feat=feat)
-            self.children[feat] = _new_node
-            _new_node.fit(new_data[:, _feat_mask].T, self.labels[_feat_mask])
+            _new_node._start, _new_node._end = bounds[_code], bounds[_code + 1]
+            _new_node._used_feat = self._used_feat | (1 << self.feature_dim)
+            self.children[key] = _new_node
+            _new_nodes.append((_code, _new_node))
+        return _new_nodes
+
+    def _gen_children(self, con_chaos, hist=None):
+        _rows = self.rows
+        _codes = self._child_codes(_rows)
+        self.tree.partition(self._start, self._end, self._child_codes)
+        _n_children = 2 if self._split_code is not None else self.tree.n_values[self.feature_dim]
+        _bounds = self._start + np.concatenate(([0], np.cumsum(np.bincount(_codes, minlength=_n_children))))
+        _new_nodes = [_new_node for _, _new_node in self._add_children(_bounds, con_chaos)]
+        if hist is not None:
+            # Histogram of the largest child = parent's histogram - histograms of its siblings
+            _largest = max(_new_nodes, key=lambda _node: _node["end"] - _node["start"])
+            _largest._hist = hist.copy()
+            for _new_node in _new_nodes:
+                if _new_node is not _largest:
+                    _new_node._hist = self.tree.histogram(_new_node.rows)
+                    _largest._hist -= _new_node._hist
+        for _new_node in _new_nodes:
+            if self.tree.n_jobs > 1 and _new_node["end"] - _new_node["start"] >= self.tree.min_parallel_size:
+                self.tree.submit(_new_node)
+            else:
+                _new_node.fit(None, None)
 
     def _handle_terminate(self):
         self.tree.depth = max(self._depth, self.tree.depth)
         self.category = self.get_class()
+        self.update_leafs(1, self.chaos, self.error)
+
+    def update_leafs(self, dw, d_chaos, d_error):
         _parent = self
         while _parent is not None:
-            _parent.leafs[self.key] = self.labels
-            _parent.weight += 1
+            _parent.weight += dw
+            _parent.leaf_chaos += d_chaos
+            _parent.leaf_error += d_error
             _parent = _parent.parent
 
-    def fit(self, data, labels, eps=1e-8):
+    def fit(self, data, labels, eps=1e-8, whether_continuous=None, n_bins=None):
         if data is not None and labels is not None:
-            self.feed_data(data, labels)
+            self.feed_data(data, labels, whether_continuous, n_bins)
+        _hist, self._hist = self._hist, None
+        _rows = self.rows
+        _labels = self.tree.y[_rows]
+        self._counts = np.bincount(_labels, minlength=self.tree.n_classes)
         if self.stop(eps):
             return
-        _cluster = Cluster(self._data.T, self.labels, self._base)
-        _max_gain, _con_chaos = _cluster.info_gain(0, criteria=self.criteria, get_con_chaos=True)
-        _max_feature = 0
-        for i in range(1, len(self._data)):
-            _tmp_gain, _tmp_con_chaos = _cluster.info_gain(i, criteria=self.criteria, get_con_chaos=True)
-            if _tmp_gain > _max_gain:
-                (_max_gain, _con_chaos), _max_feature = (_tmp_gain, _tmp_con_chaos), i
+        _features = self.tree.sample_features(self.available_features)
+        _continuous = self.tree.whether_continuous[_features]
+        _discrete = _features[~_continuous]
+        _gains, _con_chaos, _splits = np.zeros(len(_features)), np.zeros(len(_features)), [None] * len(_features)
+        if self.tree.n_bins is None:
+            _cluster = Cluster.from_codes(
+                self.tree.x[np.ix_(_discrete, _rows)] if len(_discrete) < self.tree.n_features else self.tree.x[:, _rows],
+                _labels, self.tree.n_values[_discrete], self.tree.n_classes, self._base)
+            if len(_discrete):
+                _gains[~_continuous], _con_chaos[~_continuous] = _cluster.info_gains(self.criteria)
+            for i in np.flatnonzero(_continuous):
+                _sorted = self.tree.sorted_indices[_features[i]][self._start:self._end]
+                _left, _candidates = Cluster.sorted_candidates(
+                    self.tree.x[_features[i]][_sorted], self.tree.y[_sorted], self.tree.n_classes)
+                _gains[i], _con_chaos[i], _splits[i] = _cluster.threshold_gain(_left, _candidates, self.criteria)
+        else:
+            if _hist is None:
+                _hist = self.tree.histogram(_rows)
+            _gains, _con_chaos, _splits = self._hist_gains(_hist, _features)
+        _max_feature = int(np.argmax(_gains))
+        _max_gain, _con_chaos = _gains[_max_feature], _con_chaos[_max_feature]
         if self.early_stop(_max_gain, eps):
             return
-        self.feature_dim = _max_feature
-        self._gen_children(self._data[_max_feature], self.crop(), _con_chaos)
-        if self._is_root:
-            self.tree.prune()
+        self.feature_dim = int(_features[_max_feature])
+        if _splits[_max_feature] is not None:
+            self._split_code = _splits[_max_feature]
+            self.threshold = self.tree.feature_values[self.feature_dim][self._split_code]
+        self._gen_children(_con_chaos, _hist)
+
+    def _hist_gains(self, hist, features):
+        _continuous = self.tree.whether_continuous[features]
+        _discrete = features[~_continuous]
+        _gains, _con_chaos, _splits = np.zeros(len(features)), np.zeros(len(features)), [None] * len(features)
+        _cluster = Cluster.from_tables(hist, self.tree.offsets, self._counts, self._base)
+        if len(_discrete):
+            _all_gains, _all_con_chaos = _cluster.info_gains(self.criteria)
+            _gains[~_continuous], _con_chaos[~_continuous] = _all_gains[_discrete], _all_con_chaos[_discrete]
+        for i in np.flatnonzero(_continuous):
+            _offset = self.tree.offsets[features[i]]
+            _left, _candidates = Cluster.hist_candidates(hist[_offset:_offset + self.tree.n_values[features[i]]])
+            _gains[i], _con_chaos[i], _splits[i] = _cluster.threshold_gain(_left, _candidates, self.criteria)
+        return _gains, _con_chaos, _splits
+
+    def fit_hist(self, hist, eps=1e-8):
+        """ :return: list of (code, child) -> samples whose (split) code = code go to child """
+        self._counts = np.sum(hist[:self.tree.n_values[0]], axis=0)
+        if self.stop(eps):
+            return []
+        _features = self.tree.sample_features(self.available_features)
+        _gains, _con_chaos, _splits = self._hist_gains(hist, _features)
+        _max_feature = int(np.argmax(_gains))
+        if self.early_stop(_gains[_max_feature], eps):
+            return []
+        self.feature_dim = int(_features[_max_feature])
+        _offset = self.tree.offsets[self.feature_dim]
+        _sizes = np.sum(hist[_offset:_offset + self.tree.n_values[self.feature_dim]], axis=1)
+        if _splits[_max_feature] is not None:
+            self._split_code = _splits[_max_feature]
+            self.threshold = self.tree.feature_values[self.feature_dim][self._split_code]
+            _sizes = [np.sum(_sizes[:self._split_code + 1]), np.sum(_sizes[self._split_code + 1:])]
+        return self._add_children(np.concatenate(([0], np.cumsum(_sizes))), _con_chaos[_max_feature])
 
     def prune(self):
+        """ Collapse current node into a leaf. Children are kept until the tree picks its final pruning step """
         self.category = self.get_class()
-        dw = self.weight - 1
-        self.weight = 1
-        _pop_lst = [key for key in self.leafs]
         self.mark_pruned()
-        _parent = self
-        while _parent is not None:
-            for _k in _pop_lst:
-                _parent.leafs.pop(_k)
-            _parent.leafs[self.key] = self.labels
-            _parent.weight -= dw
-            _parent = _parent.parent
-        self.children = {}
+        self.update_leafs(1 - self.weight, self.chaos - self.leaf_chaos, self.error - self.leaf_error)
 
     def mark_pruned(self):
         self.pruned = True
-        if self.children is not None:
-            for _child in self.children.values():
+        for _child in self.children.values():
+            if not _child.pruned:
                 _child.mark_pruned()
 
     def predict_one(self, x):
         if self.category is not None:
             return self.category
         try:
-            return self.children[x[self.feature_dim]].predict_one(self.crop(x))
+            if self.threshold is not None:
+                return self.children[int(float(x[self.feature_dim]) > self.threshold)].predict_one(x)
+            return self.children[x[self.feature_dim]].predict_one(x)
         except KeyError:
             return self.get_class()
 
@@ -253,6 +578,9 @@ class CvDNode:
 
     def __str__(self):
         if self.children:
+            if self.threshold is not None:
+                return "CvDNode ({}) ({} -> {} <= {:.6g})".format(
+                    self._depth, self._prev_feat, self.feature_dim, self.threshold)
             return "CvDNode ({}) ({} -> {})".format(
                 self._depth, self._prev_feat, self.feature_dim)
         return "CvDNode ({}) ({} -> class: {})".format(
@@ -275,68 +603,568 @@ class C45Node(CvDNode):
 
 # Tree
 
+# Tree being fitted in parallel, inherited by forked workers
+_parallel_tree = None
+
+
+def _fit_subtree(task):
+    """ :return: nodes of the subtree as flat records (parent index, key, attributes) """
+    _start, _end, _used_feat, _depth, _ent, _prev_feat, _hist = task
+    _tree = _parallel_tree
+    _tree.n_jobs = 1
+    _node = _tree.root.__class__(
+        _tree, _tree.root["max_depth"], _tree.root["base"], ent=_ent,
+        depth=_depth, is_root=False, prev_feat=_prev_feat)
+    _node._start, _node._end, _node._used_feat, _node._hist = _start, _end, _used_feat, _hist
+    _node.fit(None, None)
+    _records, _stack = [], [(-1, None, _node)]
+    while _stack:
+        _parent, _key, _node = _stack.pop()
+        _records.append((_parent, _key, {
+            key: value for key, value in _node.__dict__.items() if key not in ("tree", "parent", "children")
+        }))
+        # Reversed, so that 'gather' inserts children in the order of the sequential build
+        _stack += [(len(_records) - 1, key, child) for key, child in reversed(list(_node.children.items()))]
+    return _records, _tree.depth
+
+
 class CvDBase:
     def __init__(self, max_depth=None, node=None):
         self.nodes = []
-        self.trees = []
-        self._threshold_cache = None
+        self._prune_sequence = self._prune_steps = None
+        self.alphas = []
         self._max_depth = max_depth
         if node is None:
             self.root = CvDNode(self, max_depth)
         else:
             self.root = node
             self.root.feed_tree(self)
+            if max_depth is not None:
+                self.root._max_depth = max_depth
         self.depth = 1
 
+        # Encoded data shared by all nodes (x: n_features x n_samples), nodes hold ranges of 'indices'
+        self.x = self.y = self.indices = None
+        self.encoder = self.label_encoder = None
+        self.feature_values = self.label_values = self.n_values = None
+        # sorted_indices[i] keeps every node's range of rows sorted by continuous feature i
+        self.whether_continuous = self.sorted_indices = None
+        # Binned mode, offsets[i] = first row of feature i in a histogram
+        self.n_bins = self.offsets = None
+
+        # Compiled (flattened) tree, see 'compile'
+        self._compiled = None
+
+        # Number of features sampled at each node (CvDForest), None -> all
+        self.max_features, self.rng = None, None
+
+        # Parallel build, see 'submit' & 'gather'
+        self.n_jobs, self.min_parallel_size = 1, 10000
+        self._pool, self._pending, self._shared = None, [], []
+
+    @property
+    def n_features(self):
+        return len(self.n_values)
+
+    @property
+    def n_samples(self):
+        return len(self.y)
+
+    @property
+    def n_classes(self):
+        return len(self.label_values)
+
     @staticmethod
     def acc(y, y_pred):
         return np.sum(np.array(y) == np.array(y_pred)) / len(y)
 
+    def feed_data(self, data, labels, whether_continuous=None, n_bins=None):
+        if n_bins is not None and not 2 <= n_bins <= 256:
+            raise ValueError("n_bins should be between 2 and 256, {} found".format(n_bins))
+        self.n_bins = n_bins
+        data = np.asarray(data)
+        _label_encoder = CategoricalEncoder()
+        self.y = _label_encoder.fit_transform(np.asarray(labels)).astype(np.intp)
+        _encoder = ContinuousEncoder(
+            np.zeros(data.shape[1], dtype=bool) if whether_continuous is None else whether_continuous, n_bins)
+        self.x = np.ascontiguousarray(_encoder.fit_transform(data).T)
+        self._set_encoders(_encoder, _label_encoder)
+        self.indices = np.arange(len(self.y))
+        self.offsets = np.concatenate(([0], np.cumsum(self.n_values)[:-1])).astype(np.intp)
+        if n_bins is None:
+            self.sorted_indices = {
+                i: np.argsort(self.x[i], kind="stable") for i in np.flatnonzero(self.whether_continuous)
+            }
+        else:
+            self.sorted_indices = {}
+
+    def _set_encoders(self, encoder, label_encoder):
+        self.encoder, self.label_encoder = encoder, label_encoder
+        self.feature_values, self.whether_continuous = encoder["vocabularies"], encoder["whether_continuous"]
+        self.n_values, self.label_values = encoder.n_values, label_encoder["vocabularies"][0]
+
+    def histogram(self, rows):
+        _y, _n_classes = self.y[rows], self.n_classes
+        _hist = np.empty((np.sum(self.n_values), _n_classes), dtype=np.intp)
+        for i, (_offset, _n) in enumerate(zip(self.offsets, self.n_values)):
+            _hist[_offset:_offset + _n] = np.bincount(
+                self.x[i][rows].astype(np.intp) * _n_classes + _y, minlength=_n * _n_classes
+            ).reshape(_n, _n_classes)
+        return _hist
+
+    def partition(self, start, end, get_codes):
+        for _indices in [self.indices] + list(self.sorted_indices.values()):
+            _rows = _indices[start:end]
+            _indices[start:end] = _rows[np.argsort(get_codes(_rows), kind="stable")]
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return getattr(self, "_" + item)
+        return
+
+    def share_data(self, tree):
+        self.x, self.y, self.indices = tree.x, tree.y, tree.indices
+        self.sorted_indices, self.n_bins, self.offsets = tree.sorted_indices, tree.n_bins, tree.offsets
+        self._set_encoders(tree.encoder, tree.label_encoder)
+
     def copy(self):
         _new_tree = self.__class__(self._max_depth, node=self.root.copy())
+        _new_tree.share_data(self)
         _new_tree.nodes = [_node.copy() for _node in self.nodes]
         _new_tree.depth = self.depth
         return _new_tree
 
-    def fit(self, data=None, labels=None, eps=1e-8):
-        self.root.fit(data, labels, eps)
-        _arg = np.argmax([CvDBase.acc(labels, tree.predict(data)) for tree in self.trees])
-        _tar_tree = self.trees[_arg]
-        self.nodes = _tar_tree.nodes
-        self.depth = _tar_tree.depth
-        self.root = _tar_tree.root
+    def fit(self, data=None, labels=None, eps=1e-8, whether_continuous=None, n_bins=None,
+            n_jobs=1, min_parallel_size=10000, pruning="threshold", x_cv=None, y_cv=None):
+        """ :param pruning: "threshold" or "cart", x_cv & y_cv (if provided) are used to pick the pruned tree """
+        self.n_jobs = n_jobs if "fork" in mp.get_all_start_methods() else 1
+        self.min_parallel_size = min_parallel_size
+        self._prune_sequence = None
+        try:
+            self.root.fit(data, labels, eps, whether_continuous, n_bins)
+            self.gather()
+        finally:
+            self._close_pool()
+        self.prune(pruning)
+        if x_cv is None or y_cv is None:
+            _acc = self._prune_accuracies(self.x, self.y)
+        else:
+            _acc = self._prune_accuracies(self.encode(x_cv), self.encode_labels(y_cv))
+        self._apply_prune(CvDBase._best_step(_acc, pruning))
 
-    def prune(self):
-        self.trees.append(self.copy())
-        if self.depth <= 2:
+    @staticmethod
+    def _best_step(acc, pruning):
+        if pruning == "cart":
+            # Smallest tree among the best ones
+            return len(acc) - 1 - int(np.argmax(acc[::-1]))
+        return int(np.argmax(acc))
+
+    # Out-of-core
+
+    def encode_file(self, src, dst, whether_continuous=None, n_bins=None, label_idx=0, sep=",",
+                    chunk_size=100000, sample_size=100000, seed=None):
+        """ Encode a text data file into a binary file of codes for 'fit_file' """
+        if n_bins is not None and not 2 <= n_bins <= 256:
+            raise ValueError("n_bins should be between 2 and 256, {} found".format(n_bins))
+        _rng = np.random.RandomState(seed)
+        _n, _vocabularies, _label_values = 0, None, None
+        _whether_continuous, _sample, _keys = None, None, np.empty(0)
+        for _chunk in read_chunks(src, chunk_size, sep):
+            _labels, _chunk = _chunk[:, label_idx], np.delete(_chunk, label_idx, axis=1)
+            if _vocabularies is None:
+                if whether_continuous is None:
+                    _whether_continuous = np.zeros(_chunk.shape[1], dtype=bool)
+                else:
+                    _whether_continuous = np.asarray(whether_continuous, dtype=bool)
+                if n_bins is None and np.any(_whether_continuous):
+                    raise ValueError("Out-of-core fitting needs n_bins to handle continuous features")
+                _vocabularies = [None] * _chunk.shape[1]
+                _sample = np.empty((0, np.sum(_whether_continuous)))
+            _n += len(_chunk)
+            _label_values = np.unique(_labels) if _label_values is None else np.union1d(_label_values, _labels)
+            for i in np.flatnonzero(~_whether_continuous):
+                _vocabularies[i] = np.unique(_chunk[:, i]) if _vocabularies[i] is None else np.union1d(
+                    _vocabularies[i], _chunk[:, i])
+            # Uniform sample of continuous features
+            _sample = np.vstack((_sample, _chunk[:, _whether_continuous].astype(np.float64)))
+            _keys = np.concatenate((_keys, _rng.rand(len(_chunk))))
+            if len(_keys) > sample_size:
+                _kept = np.argpartition(_keys, sample_size)[:sample_size]
+                _sample, _keys = _sample[_kept], _keys[_kept]
+        self.n_bins = n_bins
+        for i, _feature in zip(np.flatnonzero(_whether_continuous), _sample.T):
+            _vocabularies[i] = ContinuousEncoder.get_edges(_feature, n_bins)
+        self._set_encoders(
+            ContinuousEncoder(_whether_continuous, n_bins).set_vocabularies(_vocabularies),
+            CategoricalEncoder().set_vocabularies([_label_values]))
+        _specs = {"x": (self.encoder["dtype"], (_n, self.n_features)), "y": (self.label_encoder["dtype"], (_n,))}
+        _encoder_arrays = self._encoder_arrays()
+        for name, arr in _encoder_arrays.items():
+            _specs[name] = (arr.dtype, arr.shape)
+        _arrays = create_arrays(dst, _specs, {"model": "data", "n_bins": n_bins})
+        for name, arr in _encoder_arrays.items():
+            _arrays[name][...] = arr
+        _start = 0
+        for _chunk in read_chunks(src, chunk_size, sep):
+            _end = _start + len(_chunk)
+            _arrays["y"][_start:_end] = self.encode_labels(_chunk[:, label_idx])
+            _arrays["x"][_start:_end] = self.encoder.transform(np.delete(_chunk, label_idx, axis=1))
+            _start = _end
+        for arr in _arrays.values():
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+    def _frontier_histograms(self, hists, codes, labels, nodes):
+        _active = nodes >= 0
+        _nodes, _labels = nodes[_active].astype(np.intp), labels[_active].astype(np.intp)
+        _n_nodes, _n_classes = len(hists), self.n_classes
+        for i, (_offset, _n) in enumerate(zip(self.offsets, self.n_values)):
+            hists[:, _offset:_offset + _n] += np.bincount(
+                (_nodes * _n + codes[i][_active]) * _n_classes + _labels, minlength=_n_nodes * _n * _n_classes
+            ).reshape(_n_nodes, _n, _n_classes)
+
+    def fit_file(self, path, eps=1e-8, chunk_size=100000, pruning="threshold"):
+        """ Fit level by level on a file written by 'encode_file', one pass over the codes per level """
+        _arrays, _meta = load_arrays(path)
+        self._load_encoder(_arrays)
+        self.n_bins = _meta["n_bins"]
+        self.offsets = np.concatenate(([0], np.cumsum(self.n_values)[:-1])).astype(np.intp)
+        self.x = self.y = self.indices = None
+        self.sorted_indices = {}
+        self._prune_sequence = None
+        _x, _y = _arrays["x"], _arrays["y"]
+        _n = len(_y)
+        _chunks = [(_start, min(_start + chunk_size, _n)) for _start in range(0, _n, chunk_size)]
+        _row_nodes = np.memmap(path + ".nodes", dtype=np.int32, mode="w+", shape=(_n,))
+        try:
+            self.root._start, self.root._end, self.root._used_feat = 0, _n, 0
+            _frontier, _routes = [self.root], None
+            while _frontier:
+                _hists = np.zeros((len(_frontier), np.sum(self.n_values), self.n_classes), dtype=np.intp)
+                for _start, _end in _chunks:
+                    _codes, _nodes = _x[_start:_end].T, _row_nodes[_start:_end]
+                    if _routes is not None:
+                        _rows = np.flatnonzero(_nodes >= 0)
+                        _nodes[_rows] = CvDBase._next_nodes(_routes, _nodes[_rows].astype(np.intp), _codes, _rows)
+                    self._frontier_histograms(_hists, _codes, _y[_start:_end], _nodes)
+                # Routes from current level to the next one, see 'compile'
+                _routes = {
+                    "feature": np.full(len(_frontier), -1, dtype=np.intp),
+                    "offset": np.full(len(_frontier), -1, dtype=np.intp),
+                    "split": np.full(len(_frontier), -1, dtype=np.intp)
+                }
+                _next_frontier, _table = [], []
+                for j, _node in enumerate(_frontier):
+                    _children = _node.fit_hist(_hists[j], eps)
+                    if not _children:
+                        continue
+                    _n_children = 2 if _node["split_code"] is not None else self.n_values[_node.feature_dim]
+                    _routes["feature"][j], _routes["offset"][j] = _node.feature_dim, len(_table)
+                    if _node["split_code"] is not None:
+                        _routes["split"][j] = _node["split_code"]
+                    _targets = [-1] * _n_children
+                    for _code, _child in _children:
+                        _targets[_code] = len(_next_frontier)
+                        _next_frontier.append(_child)
+                    _table += _targets
+                _routes["table"] = np.array(_table, dtype=np.intp)
+                _frontier = _next_frontier
+        finally:
+            del _row_nodes
+            os.remove(path + ".nodes")
+        self.prune(pruning)
+        _acc = np.zeros(len(self._prune_sequence) + 1)
+        for _start, _end in _chunks:
+            _acc += self._prune_accuracies(_x[_start:_end].T, _y[_start:_end].astype(np.intp)) * (_end - _start)
+        self._apply_prune(CvDBase._best_step(_acc, pruning))
+
+    def sample_features(self, features):
+        if self.max_features is None or len(features) <= self.max_features:
+            return features
+        return np.sort(self.rng.choice(features, self.max_features, replace=False))
+
+    def grow(self, indices):
+        """ Fit an unpruned tree on rows 'indices' (e.g. a bootstrap sample) of the shared data """
+        self.indices = np.array(indices)
+        self.sorted_indices = {
+            i: self.indices[np.argsort(self.x[i][self.indices], kind="stable")]
+            for i in (np.flatnonzero(self.whether_continuous) if self.n_bins is None else [])
+        }
+        self.root._start, self.root._end = 0, len(self.indices)
+        try:
+            self.root.fit(None, None)
+            self.gather()
+        finally:
+            self._close_pool()
+        return self.compile()
+
+    # Parallel
+
+    def submit(self, node):
+        global _parallel_tree
+        if self._pool is None:
+            # Index arrays are partitioned in place by the workers, the encoded data is inherited
+            self._shared = []
+            self.indices = self._to_shared(self.indices)
+            for i in self.sorted_indices:
+                self.sorted_indices[i] = self._to_shared(self.sorted_indices[i])
+            _parallel_tree = self
+            self._pool = mp.get_context("fork").Pool(self.n_jobs)
+        _hist, node._hist = node["hist"], None
+        self._pending.append((node, self._pool.apply_async(_fit_subtree, ((
+            node["start"], node["end"], node["used_feat"], node["depth"], node["ent"], node.prev_feat, _hist
+        ),))))
+
+    def _to_shared(self, arr):
+        _shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        self._shared.append(_shm)
+        _arr = np.ndarray(arr.shape, dtype=arr.dtype, buffer=_shm.buf)
+        _arr[:] = arr
+        return _arr
+
+    def gather(self):
+        if self._pool is None:
+            return
+        for _node, _result in self._pending:
+            _records, _depth = _result.get()
+            _nodes = [_node]
+            for _parent, _key, _record in _records:
+                if _parent >= 0:
+                    _new_node = _node.__class__()
+                    _new_node.tree, _new_node.parent = self, _nodes[_parent]
+                    _nodes[_parent].children[_key] = _new_node
+                    self.nodes.append(_new_node)
+                    _nodes.append(_new_node)
+                _nodes[-1].__dict__.update(_record)
+            _node.parent.update_leafs(_node.weight, _node.leaf_chaos, _node.leaf_error)
+            self.depth = max(self.depth, _depth)
+        self._pending = []
+        self._close_pool()
+
+    def _close_pool(self):
+        global _parallel_tree
+        if self._pool is None:
             return
-        _nodes = [_node for _node in self.nodes if _node.category is None]
-        if self._threshold_cache is None:
-            _thresholds = [_node.get_threshold() for _node in _nodes]
+        if self._pending:
+            self._pool.terminate()
         else:
-            _thresholds = self._threshold_cache
-        _arg = np.argmin(_thresholds)
-        _nodes[_arg].prune()
-        _thresholds[_arg] = _nodes[_arg].get_threshold()
-        self.depth = self.root.height
-        for i in range(len(self.nodes) - 1, -1, -1):
-            if self.nodes[i].pruned:
-                self.nodes.pop(i)
-        for i in range(len(_thresholds) - 1, -1, -1):
-            if _nodes[i].pruned:
-                _thresholds.pop(i)
-        self._threshold_cache = _thresholds
-        if self.depth > 2:
-            self.prune()
+            self._pool.close()
+        self._pool.join()
+        self.indices = np.array(self.indices)
+        for i in self.sorted_indices:
+            self.sorted_indices[i] = np.array(self.sorted_indices[i])
+        for _shm in self._shared:
+            _shm.close()
+            _shm.unlink()
+        self._pool, self._pending, self._shared = None, [], []
+        _parallel_tree = None
+
+    def prune(self, criteria="threshold"):
+        """ Record the order of collapses in self._prune_sequence, the tree itself is kept """
+        if criteria == "threshold":
+            _get_key = CvDNode.get_threshold
+        elif criteria == "cart":
+            _get_key = CvDNode.get_alpha
         else:
-            self.trees.append(self.copy())
-        pass
+            raise NotImplementedError("Pruning criteria '{}' not defined".format(criteria))
+        _nodes = self.compile()["nodes"]
+        self._prune_sequence, self.alphas = [], []
+        self._prune_steps = np.full(len(_nodes), len(_nodes), dtype=np.intp)
+        if criteria == "threshold" and self.depth <= 2:
+            return
+        _thresholds, _heap = {}, []
+        _n_internal = 0
+        for i, _node in enumerate(_nodes):
+            if _node.category is None:
+                _thresholds[i] = _get_key(_node)
+                _heap.append((_thresholds[i], i))
+                if not _node["is_root"] or criteria == "cart":
+                    _n_internal += 1
+        heapq.heapify(_heap)
+        _ids = {id(_node): i for i, _node in enumerate(_nodes)}
+        while _n_internal > 0 and _heap:
+            _threshold, i = heapq.heappop(_heap)
+            _node = _nodes[i]
+            if _node.pruned or _threshold != _thresholds[i]:
+                continue
+            _stack = [_node]
+            while _stack:
+                _sub = _stack.pop()
+                if not _sub["is_root"] or criteria == "cart":
+                    _n_internal -= 1
+                _stack += [_c for _c in _sub.children.values() if _c.category is None and not _c.pruned]
+            _node.prune()
+            self._prune_steps[i] = len(self._prune_sequence)
+            self._prune_sequence.append(i)
+            if criteria == "cart":
+                # Alphas along the path are non-decreasing
+                self.alphas.append(max(_threshold, self.alphas[-1]) if self.alphas else _threshold)
+            _parent = _node.parent
+            while _parent is not None:
+                _j = _ids[id(_parent)]
+                _thresholds[_j] = _get_key(_parent)
+                heapq.heappush(_heap, (_thresholds[_j], _j))
+                _parent = _parent.parent
+        self._prune_steps[self._prune_steps == len(_nodes)] = len(self._prune_sequence)
+
+    def _prune_accuracies(self, codes, y):
+        """ rs[i] = accuracy of the tree with the first i nodes of the pruning sequence collapsed """
+        _node_class, _steps = self._compiled["node_class"], self._prune_steps
+        _n, _n_steps = codes.shape[1], len(self._prune_sequence)
+        _diff = np.zeros(_n_steps + 2, dtype=np.intp)
+        _cur, _active = np.zeros(_n, dtype=np.intp), np.arange(_n)
+        _prefix_min = np.full(_n, _n_steps, dtype=np.intp)
+        while len(_active):
+            _node = _cur[_active]
+            _next = CvDBase._next_nodes(self._compiled, _node, codes, _active)
+            _is_end = _next < 0
+            _prev_min = _prefix_min[_active]
+            _new_min = np.minimum(_prev_min, np.where(_is_end, -1, _steps[_node]))
+            _mask = (_new_min < _prev_min) & (_node_class[_node] == y[_active])
+            _diff += np.bincount(_new_min[_mask] + 1, minlength=_n_steps + 2)
+            _diff -= np.bincount(_prev_min[_mask] + 1, minlength=_n_steps + 2)
+            _prefix_min[_active] = _new_min
+            _active, _next = _active[~_is_end], _next[~_is_end]
+            _cur[_active] = _next
+        return np.cumsum(_diff)[:_n_steps + 1] / _n
+
+    def _apply_prune(self, step):
+        _nodes = self._compiled["nodes"]
+        for i, _node in enumerate(_nodes):
+            _node.pruned = False
+            if _node.feature_dim is not None and self._prune_steps[i] >= step:
+                _node.category = None
+        for i in self._prune_sequence[:step]:
+            _nodes[i].children = {}
+        self.nodes = []
+        _stack = [self.root]
+        while _stack:
+            _node = _stack.pop()
+            self.nodes.append(_node)
+            _node.weight, _node.leaf_chaos, _node.leaf_error = 0, 0, 0
+            _stack += list(_node.children.values())
+        for _node in self.nodes:
+            if _node.category is not None:
+                _node.update_leafs(1, _node.chaos, _node.error)
+        self.depth = self.root.height - 1
+        self.compile()
+
+    def encode(self, x):
+        """ :return: codes, shape = (n_features, n_samples) """
+        return self.encoder.transform(np.atleast_2d(np.asarray(x))).T
+
+    def encode_labels(self, y):
+        return self.label_encoder.transform(np.asarray(y)).astype(np.intp)
+
+    def compile(self):
+        """ Flatten the tree (BFS order) into arrays, table[offset[i] + code] = child of node i or -1 """
+        _nodes = [self.root]
+        _feature, _offset, _table, _split, _node_class = [], [], [], [], []
+        i = _n_table = 0
+        while i < len(_nodes):
+            _node = _nodes[i]
+            _node_class.append(
+                np.searchsorted(self.label_values, _node.category) if _node.category is not None
+                else np.argmax(_node["counts"]))
+            _split.append(-1 if _node["split_code"] is None else _node["split_code"])
+            if _node.category is not None:
+                _feature.append(-1)
+                _offset.append(-1)
+            elif _node["split_code"] is not None:
+                _feature.append(_node.feature_dim)
+                _offset.append(_n_table)
+                _table.append(np.array([
+                    len(_nodes) + i for i in range(len(_node.children))
+                ], dtype=np.intp))
+                _nodes += [_node.children[_key] for _key in sorted(_node.children)]
+                _n_table += 2
+            else:
+                # One more entry for the unknown bucket of the encoder
+                _values = self.feature_values[_node.feature_dim]
+                _children = np.full(len(_values) + 1, -1, dtype=np.intp)
+                for _key, _child in _node.children.items():
+                    _children[np.searchsorted(_values, _key)] = len(_nodes)
+                    _nodes.append(_child)
+                _feature.append(_node.feature_dim)
+                _offset.append(_n_table)
+                _table.append(_children)
+                _n_table += len(_values) + 1
+            i += 1
+        self._compiled = {
+            "nodes": _nodes,
+            "feature": np.array(_feature, dtype=np.intp),
+            "offset": np.array(_offset, dtype=np.intp),
+            "table": np.concatenate(_table) if _table else np.empty(0, dtype=np.intp),
+            "split": np.array(_split, dtype=np.intp),
+            "node_class": np.array(_node_class, dtype=np.intp)
+        }
+        return self._compiled
+
+    @staticmethod
+    def _next_nodes(compiled, nodes, codes, samples):
+        _feature, _split = compiled["feature"][nodes], compiled["split"][nodes]
+        _next = np.full(len(nodes), -1, dtype=np.intp)
+        _internal = _feature >= 0
+        _code = codes[_feature[_internal], samples[_internal]]
+        _split = _split[_internal]
+        _code = np.where(_split >= 0, _code > _split, _code)
+        _next[_internal] = compiled["table"][compiled["offset"][nodes[_internal]] + _code]
+        return _next
+
+    @staticmethod
+    def _predict_nodes(compiled, codes):
+        """ Node (in compiled representation) which each sample stops at """
+        _n = codes.shape[1]
+        _cur, _active = np.zeros(_n, dtype=np.intp), np.arange(_n)
+        while len(_active):
+            _next = CvDBase._next_nodes(compiled, _cur[_active], codes, _active)
+            _active = _active[_next >= 0]
+            _cur[_active] = _next[_next >= 0]
+        return _cur
 
     def predict_one(self, x):
-        return self.root.predict_one(x)
+        return self.predict([x])[0]
 
     def predict(self, x):
-        return self.root.predict(x)
+        if self._compiled is None:
+            self.compile()
+        _codes = self.encode(x)
+        return self.label_values[self._compiled["node_class"][CvDBase._predict_nodes(self._compiled, _codes)]]
+
+    def _encoder_arrays(self):
+        _arrays = {
+            "label_values": self.label_values,
+            "whether_continuous": np.asarray(self.whether_continuous, dtype=bool),
+            "n_values": _compact(np.asarray(self.n_values, dtype=np.intp))
+        }
+        for i, values in enumerate(self.feature_values):
+            _arrays["feature_values_{}".format(i)] = values
+        return _arrays
+
+    def _load_encoder(self, arrays):
+        self._set_encoders(
+            ContinuousEncoder(arrays["whether_continuous"]).set_vocabularies(
+                [arrays["feature_values_{}".format(i)] for i in range(len(arrays["n_values"]))]),
+            CategoricalEncoder().set_vocabularies([arrays["label_values"]]))
+
+    def save(self, path):
+        """ Node objects are not saved, so a loaded tree can only predict """
+        if self._compiled is None:
+            self.compile()
+        _arrays = self._encoder_arrays()
+        for key in ("feature", "offset", "table", "split", "node_class"):
+            _arrays[key] = _compact(self._compiled[key])
+        save_arrays(path, _arrays, {"model": self.__class__.__name__, "depth": self.depth})
+
+    def load(self, path, mmap=True):
+        _arrays, _meta = load_arrays(path, mmap)
+        self._load_encoder(_arrays)
+        self._compiled = {
+            key: _arrays[key] for key in ("feature", "offset", "table", "split", "node_class")
+        }
+        self.nodes, self.depth = [], _meta["depth"]
+        self._prune_sequence = self._prune_steps = None
+        return self
 
     def view(self):
         self.root.view()
@@ -362,6 +1190,132 @@ class C45Tree(CvDBase):
         else:
             CvDBase.__init__(self, *args, **kwargs)
 
+
+# Forest
+
+# Forest being fitted, inherited by forked workers
+_parallel_forest = None
+
+
+def _grow_forest_tree(i):
+    return _parallel_forest.grow_tree(i)
+
+
+class CvDForest:
+    def __init__(self, tree=C45Tree, n_trees=10, max_depth=None, max_features="sqrt", n_jobs=1, seed=None):
+        self._tree, self._n_trees, self._max_depth = tree, n_trees, max_depth
+        self._max_features, self._n_jobs = max_features, n_jobs
+        self._seed = np.random.randint(2 ** 31) if seed is None else seed
+        self._base = None
+        self._compiled = []
+        self._oob_votes = None
+        self.oob_scores = []
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return getattr(self, "_" + item)
+        return
+
+    @property
+    def oob_score(self):
+        return self.oob_scores[-1] if self.oob_scores else None
+
+    def _get_max_features(self):
+        _n_features = self._base.n_features
+        if self._max_features == "sqrt":
+            return max(1, int(math.sqrt(_n_features)))
+        if self._max_features == "log2":
+            return max(1, int(math.log2(_n_features)))
+        return self._max_features
+
+    def grow_tree(self, i):
+        """ :return: (compiled arrays, out-of-bag rows, encoded predictions on out-of-bag rows) """
+        _rng = np.random.RandomState(self._seed + i)
+        _n = self._base.n_samples
+        _indices = _rng.randint(_n, size=_n)
+        _tree = self._tree(self._max_depth)
+        _tree.share_data(self._base)
+        _tree.max_features, _tree.rng = self._get_max_features(), _rng
+        _compiled = _tree.grow(_indices)
+        del _compiled["nodes"]
+        _in_bag = np.zeros(_n, dtype=bool)
+        _in_bag[_indices] = True
+        _oob = np.flatnonzero(~_in_bag)
+        return _compiled, _oob, _compiled["node_class"][CvDBase._predict_nodes(_compiled, self._base.x[:, _oob])]
+
+    def _add_tree(self, result):
+        _compiled, _oob, _oob_pred = result
+        self._compiled.append(_compiled)
+        self._oob_votes[_oob, _oob_pred] += 1
+        _voted = np.flatnonzero(np.sum(self._oob_votes, axis=1))
+        self.oob_scores.append(
+            np.mean(np.argmax(self._oob_votes[_voted], axis=1) == self._base.y[_voted]) if len(_voted) else None)
+
+    def fit(self, data, labels, whether_continuous=None, n_bins=None):
+        global _parallel_forest
+        self._base = self._tree(self._max_depth)
+        self._base.feed_data(data, labels, whether_continuous, n_bins)
+        self._compiled, self.oob_scores = [], []
+        self._oob_votes = np.zeros((self._base.n_samples, self._base.n_classes), dtype=np.intp)
+        if self._n_jobs > 1 and "fork" in mp.get_all_start_methods():
+            _parallel_forest = self
+            try:
+                with mp.get_context("fork").Pool(self._n_jobs) as _pool:
+                    for _result in _pool.imap_unordered(_grow_forest_tree, range(self._n_trees)):
+                        self._add_tree(_result)
+            finally:
+                _parallel_forest = None
+        else:
+            for i in range(self._n_trees):
+                self._add_tree(self.grow_tree(i))
+        return self
+
+    def predict_votes(self, x):
+        _codes = self._base.encode(x)
+        _votes = np.zeros((_codes.shape[1], self._base.n_classes), dtype=np.intp)
+        _rows = np.arange(_codes.shape[1])
+        for _compiled in self._compiled:
+            _votes[_rows, _compiled["node_class"][CvDBase._predict_nodes(_compiled, _codes)]] += 1
+        return _votes
+
+    def predict(self, x):
+        return self._base.label_values[np.argmax(self.predict_votes(x), axis=1)]
+
+    def save(self, path):
+        _arrays = self._base._encoder_arrays()
+        _keys = ("feature", "offset", "split", "node_class")
+        _n_nodes = [len(_compiled["feature"]) for _compiled in self._compiled]
+        _n_tables = [len(_compiled["table"]) for _compiled in self._compiled]
+        _arrays["node_starts"] = np.cumsum([0] + _n_nodes)
+        _arrays["table_starts"] = np.cumsum([0] + _n_tables)
+        for key in _keys:
+            _arrays[key] = _compact(np.concatenate([_compiled[key] for _compiled in self._compiled]))
+        _arrays["table"] = _compact(np.concatenate(
+            [_compiled["table"] for _compiled in self._compiled] + [np.empty(0, dtype=np.intp)]))
+        save_arrays(path, _arrays, {"model": "CvDForest", "tree": self._tree.__name__})
+
+    def load(self, path, mmap=True):
+        _arrays, _meta = load_arrays(path, mmap)
+        self._base = self._tree(self._max_depth)
+        self._base._load_encoder(_arrays)
+        _node_starts, _table_starts = _arrays["node_starts"], _arrays["table_starts"]
+        self._compiled = [{
+            "feature": _arrays["feature"][_node_starts[i]:_node_starts[i + 1]],
+            "offset": _arrays["offset"][_node_starts[i]:_node_starts[i + 1]],
+            "split": _arrays["split"][_node_starts[i]:_node_starts[i + 1]],
+            "node_class": _arrays["node_class"][_node_starts[i]:_node_starts[i + 1]],
+            "table": _arrays["table"][_table_starts[i]:_table_starts[i + 1]]
+        } for i in range(len(_node_starts) - 1)]
+        self._n_trees = len(self._compiled)
+        self._oob_votes, self.oob_scores = None, []
+        return self
+
+    def __str__(self):
+        return "CvDForest ({} trees)".format(len(self._compiled))
+
+    __repr__ = __str__
+
+
 if __name__ == '__main__':
     _data, _x, _y = [], [], []
     with open("data.txt", "r") as file:
@@ -371,12 +1325,7 @@ if __name__ == '__main__':
     for line in _data:
         _y.append(line.pop(0))
         _x.append(line)
-    _x, _y = np.array(_x).T, np.array(_y)
-    for _i, line in enumerate(_x):
-        _dic = {_c: i for i, _c in enumerate(set(line))}
-        for _j, elem in enumerate(line):
-            _x[_i][_j] = _dic[elem]
-    _x = _x.T
+    _x, _y = CategoricalEncoder().fit_transform(np.array(_x)), np.array(_y)
     train_num = 5000
     x_train = _x[:train_num]
     y_train = _y[:train_num]
@@ -394,6 +1343,6 @@ if __name__ == '__main__':
     _t = time.time()
     _sk_tree = DecisionTreeClassifier()
     _sk_tree.fit(x_train, y_train)
-    _y_pred = _tree.predict(x_test)
+    _y_pred = _sk_tree.predict(x_test)
     print(np.sum(_y_pred == y_test) / len(y_test))
     print(time.time() - _t)
@@ -3,8 +3,9 @@ import numpy as np
 from math import pi, exp, log
 import matplotlib.pyplot as plt
 
-from NaiveBayes import MergedNB
+from NaiveBayes import NaiveBayes, MergedNB
 from CvDTree import C45Tree
+from Encoder import CategoricalEncoder
 
 try:
     from mpl_toolkits.mplot3d import Axes3D
@@ -110,9 +111,17 @@ class AdaBoost:
         ty[ty == 0] = -1
         if self._sample_weight is None:
             self._sample_weight = np.ones(len(x)) / len(x)
+        _nb_clf = None
         for _ in range(epoch):
-            tmp_clf = AdaBoost._weak_clf[clf](*args, **kwargs)
-            tmp_clf.fit(x, y, self._sample_weight)
+            if _nb_clf is not None:
+                # NaiveBayes fitted in this call keeps its encoded data, so later rounds only recompute its tables
+                tmp_clf = _nb_clf.copy()
+                tmp_clf.reweight(self._sample_weight)
+            else:
+                tmp_clf = AdaBoost._weak_clf[clf](*args, **kwargs)
+                tmp_clf.fit(x, y, self._sample_weight)
+                if isinstance(tmp_clf, NaiveBayes):
+                    _nb_clf = tmp_clf
             y_pred = tmp_clf.predict(x)
             em = min(max((y_pred != y).dot(self._sample_weight[:, None])[0], eps), 1 - eps)
             am = 0.5 * log(1 / em - 1)
@@ -296,14 +305,7 @@ if __name__ == '__main__':
     for _line in _data:
         _y.append(_line.pop(0))
         _x.append(_line)
-    _x = np.array(_x).T
-    for _i, _line in enumerate(_x):
-        _dic = {_c: i for i, _c in enumerate(set(_line))}
-        for _j, _elem in enumerate(_line):
-            _x[_i][_j] = _dic[_elem]
-    _dic = {_c: i for i, _c in enumerate(set(_y))}
-    _y = np.array([_dic[_yy] for _yy in _y])
-    _x = _x.T
+    _x, _y = CategoricalEncoder().fit_transform(np.array(_x)), CategoricalEncoder().fit_transform(_y)
     train_num = 5000
     train_x = _x[:train_num]
     train_y = _y[:train_num]
@@ -1,94 +1,73 @@
 import time
 import math
 import numpy as np
-from collections import Counter as Count
 
 from sklearn.tree import DecisionTreeClassifier
 
+from Encoder import CategoricalEncoder
+
 # TODO: Debug - Pruning, CART Pruning
 # TODO: Try batch prediction and visualization
-# TODO: Support Continuous Data ; Feed sample-weight
-
-
-# Util
+# TODO: Support Continuous Data
 
 
 # Util
 
-class Counter:
-
-    def __init__(self, arr, sample_weights=None):
-        if sample_weights is None:
-            self._counter = Count(arr)
-        else:
-            self._counter = {}
-            sw_len = len(sample_weights)
-            for elem, w in zip(arr, sample_weights):
-                if elem not in self._counter:
-                    self._counter[elem] = w * sw_len
-                else:
-                    self._counter[elem] += w * sw_len
-
-    def keys(self):
-        return self._counter.keys()
-
-    def values(self):
-        return self._counter.values()
-
-    def __getitem__(self, item):
-        return self._counter[item]
-
-
 class Cluster:
-    def __init__(self, data, labels, sample_weights=None, base=2):
-        self._data = np.array(data).T
-        self._labels = np.array(labels)
-        self._counter = Counter(labels, sample_weights)
-        self._sample_weights = sample_weights
-        self._cache = None
+    def __init__(self, codes, labels, n_values, n_classes, sample_weights=None, base=2):
+        """ :param codes: integer-coded features, shape = (n_features, n_samples) """
+        self._counts = np.bincount(labels, weights=sample_weights, minlength=n_classes)
+        self._offsets = np.concatenate(([0], np.cumsum(n_values)[:-1])).astype(np.intp)
+        _flat = (codes.astype(np.intp) + self._offsets[:, None]) * n_classes + labels
+        self._tables = np.bincount(
+            _flat.ravel(), weights=None if sample_weights is None else np.tile(sample_weights, len(codes)),
+            minlength=int(np.sum(n_values)) * n_classes).reshape(-1, n_classes)
         self._base = base
 
+    @staticmethod
+    def _ent_rows(counts, base, eps=1e-12):
+        _total = np.sum(counts, axis=-1, keepdims=True)
+        _p = counts / np.where(_total > 0, _total, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            _log_p = np.where(_p > 0, np.log(_p), 0)
+        return np.maximum(eps, -np.sum(_p * _log_p, axis=-1) / math.log(base))
+
+    @staticmethod
+    def _gini_rows(counts):
+        _total = np.sum(counts, axis=-1, keepdims=True)
+        return 1 - np.sum((counts / np.where(_total > 0, _total, 1)) ** 2, axis=-1)
+
     def ent(self, ent=None, eps=1e-12):
-        _len = len(self._labels)
         if ent is None:
-            ent = [_val for _val in self._counter.values()]
-        return max(eps, -sum([_c / _len * math.log(_c / _len, self._base) for _c in ent]))
+            ent = self._counts
+        return float(Cluster._ent_rows(np.asarray(ent, dtype=np.float64), self._base, eps))
 
     def gini(self, p=None):
         if p is None:
-            p = [_val for _val in self._counter.values()]
-        return 1 - sum([(_p / len(self._labels)) ** 2 for _p in p])
+            p = self._counts
+        return float(Cluster._gini_rows(np.asarray(p, dtype=np.float64)))
 
-    def con_chaos(self, idx, criteria="ent"):
-        if criteria == "ent":
-            _method = lambda cluster: cluster.ent()
-        elif criteria == "gini":
-            _method = lambda cluster: cluster.gini()
-        else:
-            raise NotImplementedError("Conditional info criteria '{}' not defined".format(criteria))
-        data = self._data[idx]
-        features = list(sorted(set(data)))
-        self._cache = tmp_labels = [data == feature for feature in features]
-        label_lst = [self._labels[label] for label in tmp_labels]
-        rs = 0
-        for data_label, tar_label in zip(tmp_labels, label_lst):
-            tmp_data = self._data.T[data_label]
-            _ent = _method(Cluster(tmp_data, tar_label, self._sample_weights, self._base))
-            rs += len(tmp_data) / len(data) * _ent
-        return rs
-
-    def info_gain(self, idx, criteria="ent", get_con_chaos=False):
+    def info_gains(self, criteria="ent"):
+        """ :return: (gains, con_chaos) -> arrays whose i-th element belongs to feature i """
+        _value_counts = np.sum(self._tables, axis=1)
+        _len = np.sum(self._counts)
         if criteria in ("ent", "ratio"):
-            _con_chaos = self.con_chaos(idx)
-            _gain = self.ent() - _con_chaos
+            _con_chaos = np.add.reduceat(_value_counts * Cluster._ent_rows(self._tables, self._base), self._offsets)
+            _con_chaos /= _len
+            _gains = self.ent() - _con_chaos
             if criteria == "ratio":
-                _gain = _gain / self.ent([np.sum(_cache) for _cache in self._cache])
+                _p = _value_counts / _len
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    _p_log_p = np.where(_p > 0, _p * np.log(_p), 0)
+                _gains /= np.maximum(1e-12, -np.add.reduceat(_p_log_p, self._offsets) / math.log(self._base))
         elif criteria == "gini":
-            _con_chaos = self.con_chaos(idx, criteria="gini")
-            _gain = self.gini() - _con_chaos
+            _con_chaos = np.add.reduceat(_value_counts * Cluster._gini_rows(self._tables), self._offsets) / _len
+            _gains = self.gini() - _con_chaos
         else:
             raise NotImplementedError("Info_gain criteria '{}' not defined".format(criteria))
-        return (_gain, _con_chaos) if get_con_chaos else _gain
+        # Feature with only one value cannot split (avoid dividing rounding errors by split info)
+        _gains[np.add.reduceat((_value_counts > 0).astype(np.intp), self._offsets) == 1] = 0
+        return _gains, _con_chaos
 
 
 # Node
@@ -96,11 +75,13 @@ class Cluster:
 class CvDNode:
     def __init__(self, tree=None, max_depth=None, base=2, ent=None,
                  depth=0, parent=None, is_root=True, prev_feat="Root"):
-        self._data = self.labels = None
+        # Rows of current node = tree.indices[_start:_end]
+        self._start = self._end = 0
+        self._features = self._counts = None
         self._max_depth = max_depth
         self._base = base
         self._ent = ent
-        self._sw_cache = self._eps_cache = None
+        self._eps_cache = None
         self.criteria = None
         self.children = {}
         self.category = None
@@ -114,6 +95,7 @@ class CvDNode:
         self._is_root = is_root
         self._prev_feat = prev_feat
         self.weight = 0
+        # key -> class counts of every leaf below
         self.leafs = {}
         self.pruned = False
 
@@ -136,6 +118,20 @@ class CvDNode:
     def prev_feat(self):
         return self._prev_feat
 
+    @property
+    def rows(self):
+        return self.tree.indices[self._start:self._end]
+
+    @property
+    def labels(self):
+        return self.tree.label_values[self.tree.y[self.rows]]
+
+    @property
+    def sample_weights(self):
+        if self.tree.sample_weights is None:
+            return None
+        return self.tree.sample_weights[self.rows]
+
     def copy(self):
         _new_node = self.__class__(
             None, self._max_depth, self._base, self._ent,
@@ -143,16 +139,16 @@ class CvDNode:
         _new_node.tree = self.tree
         _new_node.feature_dim = self.feature_dim
         _new_node.category = self.category
-        _new_node.labels = self.labels
+        _new_node._start, _new_node._end = self._start, self._end
+        _new_node._features, _new_node._counts = self._features, self._counts
         _new_node.pruned = self.pruned
         if self.children:
             for key, node in self.children.items():
                 _new_node.children[key] = node.copy()
         else:
             _new_node.category = self.category
-        if self.leafs:
-            for key, leaf in self.leafs.items():
-                _new_node.leafs[key] = leaf.copy()
+        _new_node.weight = self.weight
+        _new_node.leafs = dict(self.leafs)
         return _new_node
 
     def feed_tree(self, tree):
@@ -160,12 +156,13 @@ class CvDNode:
         self.tree.nodes.append(self)
 
     def feed_data(self, data, labels):
-        self._data = np.array(data).T
-        self.labels = np.array(labels)
+        self.tree.feed_data(data, labels)
+        self._start, self._end = 0, len(self.tree.y)
+        self._features = np.arange(len(self.tree.n_values))
 
     def stop(self, eps):
         if (
-            self._data.shape[1] == 1 or (self._ent is not None and self._ent <= eps)
+            not len(self._features) or self._end - self._start == 1 or (self._ent is not None and self._ent <= eps)
             or (self._max_depth is not None and self._depth >= self._max_depth)
         ):
             self._handle_terminate()
@@ -178,61 +175,68 @@ class CvDNode:
             return True
         return False
 
-    def crop(self, x=None):
-        x = self._data if x is None else x
-        _mask = np.ones(len(x), dtype=np.bool)
-        _mask[self.feature_dim] = False
-        return x[_mask]
-
     def get_class(self):
-        _counter = Counter(self.labels)
-        return max(_counter.keys(), key=(lambda key: _counter[key]))
+        return self.tree.label_values[np.argmax(self._counts)]
 
     def get_threshold(self):
         if self.category is None:
-            rs = 0
-            for leaf in self.leafs.values():
-                _cluster = Cluster(None, leaf, base=self._base)
-                rs += len(leaf) * _cluster.ent()
-            return Cluster(None, self.labels, base=self._base).ent() - rs / (self.weight - 1)
+            _leafs = np.array(list(self.leafs.values()), dtype=np.float64)
+            rs = np.sum(np.sum(_leafs, axis=1) * Cluster._ent_rows(_leafs, self._base))
+            return float(Cluster._ent_rows(self._counts.astype(np.float64), self._base)) - rs / (self.weight - 1)
         return 0
 
-    def _gen_children(self, features, new_data, con_chaos):
-        for feat in set(features):
-            _feat_mask = features == feat
+    def _gen_children(self, con_chaos):
+        _rows = self.rows
+        _codes = self.tree.x[self.feature_dim][_rows]
+        self.tree.indices[self._start:self._end] = _rows[np.argsort(_codes, kind="stable")]
+        _bounds = self._start + np.concatenate((
+            [0], np.cumsum(np.bincount(_codes, minlength=self.tree.n_values[self.feature_dim]))))
+        _features = self._features[self._features != self.feature_dim]
+        for _code, feat in enumerate(self.tree.feature_values[self.feature_dim]):
+            if _bounds[_code] == _bounds[_code + 1]:
+                continue
             _new_node = self.__class__(
                 self.tree, self._max_depth, self._base, ent=con_chaos,
                 depth=self._depth + 1, parent=self, is_root=False, prev_feat=feat)
             self.children[feat] = _new_node
-            _new_node.fit(new_data[:, _feat_mask].T, self.labels[_feat_mask],
-                          self._sw_cache, self._eps_cache)
+            _new_node._start, _new_node._end = _bounds[_code], _bounds[_code + 1]
+            _new_node._features = _features
+            _new_node.fit(None, None, eps=self._eps_cache)
 
     def _handle_terminate(self):
         self.tree.depth = max(self._depth, self.tree.depth)
         self.category = self.get_class()
         _parent = self
         while _parent is not None:
-            _parent.leafs[self.key] = self.labels
+            _parent.leafs[self.key] = self._counts
             _parent.weight += 1
             _parent = _parent.parent
 
-    def fit(self, data, labels, sample_weights=None, eps=1e-8):
+    def fit(self, data, labels, sample_weight=None, eps=1e-8):
         if data is not None and labels is not None:
             self.feed_data(data, labels)
+        if self._is_root:
+            if sample_weight is None:
+                self.tree.sample_weights = None
+            else:
+                # Rescaled to sum to the number of samples, as leaf sizes in 'get_threshold'
+                sample_weight = np.asarray(sample_weight, dtype=np.float64)
+                self.tree.sample_weights = sample_weight * len(sample_weight) / np.sum(sample_weight)
+        _rows, _weights = self.rows, self.sample_weights
+        _labels = self.tree.y[_rows]
+        self._counts = np.bincount(_labels, weights=_weights, minlength=len(self.tree.label_values))
         if self.stop(eps):
             return
-        _cluster = Cluster(self._data.T, self.labels, sample_weights, self._base)
-        _max_gain, _con_chaos = _cluster.info_gain(0, criteria=self.criteria, get_con_chaos=True)
-        _max_feature = 0
-        for i in range(1, len(self._data)):
-            _tmp_gain, _tmp_con_chaos = _cluster.info_gain(i, criteria=self.criteria, get_con_chaos=True)
-            if _tmp_gain > _max_gain:
-                (_max_gain, _con_chaos), _max_feature = (_tmp_gain, _tmp_con_chaos), i
-        if self.early_stop(_max_gain, eps):
+        _cluster = Cluster(
+            self.tree.x[np.ix_(self._features, _rows)], _labels, self.tree.n_values[self._features],
+            len(self.tree.label_values), _weights, self._base)
+        _gains, _con_chaos = _cluster.info_gains(self.criteria)
+        _max_feature = int(np.argmax(_gains))
+        if self.early_stop(_gains[_max_feature], eps):
             return
-        self._sw_cache, self._eps_cache = sample_weights, eps
-        self.feature_dim = _max_feature
-        self._gen_children(self._data[_max_feature], self.crop(), _con_chaos)
+        self._eps_cache = eps
+        self.feature_dim = int(self._features[_max_feature])
+        self._gen_children(_con_chaos[_max_feature])
         if self._is_root:
             self.tree.prune()
 
@@ -246,7 +250,7 @@ class CvDNode:
         while _parent is not None:
             for _k in _pop_lst:
                 _parent.leafs.pop(_k)
-            _parent.leafs[self.key] = self.labels
+            _parent.leafs[self.key] = self._counts
             _parent.weight -= dw
             _parent = _parent.parent
         self.children = {}
@@ -261,7 +265,7 @@ class CvDNode:
         if self.category is not None:
             return self.category
         try:
-            return self.children[x[self.feature_dim]].predict_one(self.crop(x))
+            return self.children[x[self.feature_dim]].predict_one(x)
         except KeyError:
             return self.get_class()
 
@@ -310,27 +314,52 @@ class CvDBase:
         self.nodes = []
         self.trees = []
         self._threshold_cache = None
+        self.sample_weights = None
         self._max_depth = max_depth
         if node is None:
             self.root = CvDNode(self, max_depth)
         else:
             self.root = node
             self.root.feed_tree(self)
+            if max_depth is not None:
+                self.root._max_depth = max_depth
         self.depth = 1
 
+        # Encoded data shared by all nodes (x: n_features x n_samples), nodes hold ranges of 'indices'
+        self.x = self.y = self.indices = None
+        self.feature_values = self.label_values = self.n_values = None
+
+    def feed_data(self, data, labels):
+        _encoder, _label_encoder = CategoricalEncoder(), CategoricalEncoder()
+        self.x = np.ascontiguousarray(_encoder.fit_transform(np.asarray(data)).T)
+        self.y = _label_encoder.fit_transform(np.asarray(labels)).astype(np.intp)
+        self.feature_values, self.n_values = _encoder["vocabularies"], _encoder.n_values
+        self.label_values = _label_encoder["vocabularies"][0]
+        self.indices = np.arange(len(self.y))
+
     @staticmethod
-    def acc(y, yp):
-        return np.sum(np.array(y) == np.array(yp)) / len(y)
+    def acc(y, yp, sample_weight=None):
+        if sample_weight is None:
+            return np.sum(np.array(y) == np.array(yp)) / len(y)
+        return np.sum((np.array(y) == np.array(yp)) * sample_weight) / np.sum(sample_weight)
 
     def copy(self):
         _new_tree = self.__class__(self._max_depth, node=self.root.copy())
+        _new_tree.sample_weights = self.sample_weights
+        _new_tree.x, _new_tree.y, _new_tree.indices = self.x, self.y, self.indices
+        _new_tree.feature_values, _new_tree.label_values = self.feature_values, self.label_values
+        _new_tree.n_values = self.n_values
         _new_tree.nodes = [_node.copy() for _node in self.nodes]
         _new_tree.depth = self.depth
         return _new_tree
 
-    def fit(self, data=None, labels=None, sample_weights=None, eps=1e-8):
-        self.root.fit(data, labels, sample_weights, eps)
-        _arg = np.argmax([CvDBase.acc(labels, tree.predict(data)) for tree in self.trees])
+    def fit(self, data=None, labels=None, sample_weight=None, eps=1e-8):
+        """
+        :param sample_weight: weights of samples (e.g. from AdaBoost), used in split search, leaf classes
+                              and pruning (thresholds and the accuracy which picks the pruned tree)
+        """
+        self.root.fit(data, labels, sample_weight, eps)
+        _arg = np.argmax([CvDBase.acc(labels, tree.predict(data), sample_weight) for tree in self.trees])
         _tar_tree = self.trees[_arg]
         self.nodes = _tar_tree.nodes
         self.depth = _tar_tree.depth
@@ -405,12 +434,7 @@ if __name__ == '__main__':
     for line in _data:
         _y.append(line.pop(0))
         _x.append(line)
-    _x, _y = np.array(_x).T, np.array(_y)
-    for _i, line in enumerate(_x):
-        _dic = {_c: i for i, _c in enumerate(set(line))}
-        for _j, _elem in enumerate(line):
-            _x[_i][_j] = _dic[_elem]
-    _x = _x.T
+    _x, _y = CategoricalEncoder().fit_transform(np.array(_x)), np.array(_y)
     train_num = 5000
     x_train = _x[:train_num]
     y_train = _y[:train_num]
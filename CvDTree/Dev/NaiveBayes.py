@@ -1,9 +1,12 @@
+import copy
 import numpy as np
-from math import pi, exp
+import multiprocessing as mp
+from math import exp
+from functools import reduce
 from collections import Counter
 from abc import ABCMeta, abstractmethod
 
-sqrt_pi = pi ** 0.5
+from Encoder import CategoricalEncoder, HashingEncoder
 
 SKIP_FIRST = True
 
@@ -27,39 +30,50 @@ class Util:
                 x.append(Util.data_cleaning(line))
         return x
 
-    @staticmethod
-    def gaussian(x, mu, sigma):
-        return exp(-(x - mu) ** 2 / (2 * sigma ** 2)) / (sqrt_pi * sigma)
-
 
 class NBFunctions:
 
-    # noinspection PyTypeChecker
     @staticmethod
-    def gaussian_maximum_likelihood(labelled_x, n_category, dim):
+    def normalize_log_probabilities(log_p):
+        """ p(c|x) of every row from (unnormalized) log p(x, c) via log-sum-exp, which avoids underflow """
+        _max = np.max(log_p, axis=1, keepdims=True)
+        log_p = log_p - _max
+        return np.exp(log_p - np.log(np.sum(np.exp(log_p), axis=1, keepdims=True)))
+
+    @staticmethod
+    def merge_values(values1, values2):
+        """
+        :param values1: sorted distinct values
+        :param values2: sorted distinct values
+        :return:        (union, (positions of values1 in union, positions of values2 in union))
+        """
+        union = np.union1d(values1, values2)
+        return union, (np.searchsorted(union, values1), np.searchsorted(union, values2))
+
 
-        mu = [np.sum(
-            labelled_x[c][dim]) / len(labelled_x[c][dim]) for c in range(n_category)]
-        sigma = [np.sum(
-            (labelled_x[c][dim] - mu[c]) ** 2) / len(labelled_x[c][dim]) for c in range(n_category)]
+# Set by 'fit_parallel' before forking, so that workers read the data without pickling it
+_parallel_nb = None
 
-        def func(_c):
-            def sub(_x):
-                return Util.gaussian(_x, mu[_c], sigma[_c])
-            return sub
 
-        return [func(_c=c) for c in range(n_category)]
+def _nb_chunk_statistics(start):
+    _nb, _data, _tar_idx, _chunk_size = _parallel_nb
+    return _nb["data_statistics"](_data[start:start + _chunk_size], _tar_idx)
 
 
 class NaiveBayes(metaclass=ABCMeta):
 
+    # Whether '_log_likelihood' is implemented (batch prediction in log space)
+    _vectorized = False
+
     def __init__(self):
         self._func = None
+        self._custom_func = False
+        self._log_prior = None
         self._tar_idx = None
         self._n_possibilities = None
         self._x = self._y = None
-        self._labelled_x = self._label_zip = None
-        self._category = self._categories = self._category_info = None
+        self._statistics = None
+        self._category = self._encoder = None
         self._initialized = False
 
     def __getitem__(self, item):
@@ -67,6 +81,13 @@ class NaiveBayes(metaclass=ABCMeta):
             return getattr(self, "_" + item)
         return
 
+    @staticmethod
+    def _get_tar_idx(tar_idx, attr_len):
+        tar_idx = int(tar_idx)
+        if tar_idx < 0:
+            tar_idx = max(0, attr_len + tar_idx)
+        return tar_idx
+
     @abstractmethod
     def feed_data(self, data, tar_idx=-1):
         pass
@@ -76,14 +97,15 @@ class NaiveBayes(metaclass=ABCMeta):
         pass
 
     def get_prior_probability(self, lb):
-        return [(_c_num + lb) / (len(self._x) + lb * len(self._category))
-                for _c_num in sorted(self._category.values())]
+        return [(self._category[_c] + lb) / (sum(self._category.values()) + lb * len(self._category))
+                for _c in sorted(self._category)]
 
     def fit(self, x=None, y=None, sample_weight=None, lb=1, func=None):
         """
             self._x:               input matrix     :  x = (x1, ..., xn)              (xi is a vector)
             self._y:               target vector    :  y = (ω1, ..., ωn)              (ωi = 1, ..., m)
-            self._category:        Counter          :  Counter(y)
+            self._statistics:      dict             :  sufficient statistics (weighted counts, sums, ...) of the data
+            self._category:        Counter          :  (weighted) counts of every class
             self._n_possibilities: list             :  If ωi is discrete, list[i] = n_possibilities
                                                            else, list[i] = None or pre_configured_function
         :param x:               input matrix        :  x = self.x if x or y is None
@@ -97,6 +119,7 @@ class NaiveBayes(metaclass=ABCMeta):
             self.feed_data(np.hstack((x, y[:, None])))
         if sample_weight is not None:
             self.feed_sample_weight(sample_weight)
+        self._custom_func = func is not None
         if func is None:
             func = self._fit(lb)
 
@@ -106,7 +129,84 @@ class NaiveBayes(metaclass=ABCMeta):
     def _fit(self, lb):
         pass
 
+    def _data_statistics(self, data, tar_idx, sample_weight=None):
+        """ Sufficient statistics of raw data (rows with the target at tar_idx) """
+        raise NotImplementedError("Sufficient statistics are not implemented in {}".format(self))
+
+    @staticmethod
+    def _merge_statistics(statistics1, statistics2):
+        raise NotImplementedError("Sufficient statistics are not implemented")
+
+    def _set_statistics(self, statistics):
+        self._statistics = statistics
+        self._initialized = True
+
+    def _drop_data(self):
+        self._x = self._y = None
+
+    def copy(self):
+        """ Shallow copy, which shares the fed data but is fitted independently (e.g. with other sample weights) """
+        return copy.copy(self)
+
+    def reweight(self, sample_weight, lb=1):
+        """
+        Refit on the data of 'feed_data' with new sample weights, e.g. in every round of AdaBoost
+        Encoded data is kept, so only the class-conditional tables are recomputed
+        """
+        self.feed_sample_weight(sample_weight)
+        self._custom_func = False
+        self._func = self._fit(lb)
+
+    def partial_fit(self, data, tar_idx=-1, sample_weight=None, lb=1):
+        """
+        Merge the sufficient statistics of a new chunk of raw data into the model & refit
+        Codes of the data fed by 'feed_data' may change after merging, so that data is dropped
+        :param data:           raw data, target at tar_idx
+        :param sample_weight:  weights of the rows of this chunk, np.ones if is None
+        """
+        data = np.array(data)
+        self._tar_idx = self._get_tar_idx(tar_idx, data.shape[1])
+        statistics = self._data_statistics(data, self._tar_idx, sample_weight)
+        if self._statistics is not None:
+            statistics = self._merge_statistics(self._statistics, statistics)
+        self._set_statistics(statistics)
+        self._drop_data()
+        self._custom_func = False
+        self._func = self._fit(lb)
+
+    def fit_parallel(self, data, tar_idx=-1, n_jobs=None, chunk_size=100000, lb=1):
+        """
+        Compute sufficient statistics of chunks of raw data in a process pool, merge them & fit
+        The result is the same as the one of a single 'partial_fit' on all data
+        :param n_jobs:      number of processes (needs 'fork' start method), cpu count if is None
+        :param chunk_size:  rows per chunk
+        """
+        global _parallel_nb
+        data = np.array(data)
+        self._tar_idx = self._get_tar_idx(tar_idx, data.shape[1])
+        _starts = range(0, len(data), chunk_size)
+        n_jobs = mp.cpu_count() if n_jobs is None else n_jobs
+        if n_jobs > 1 and len(_starts) > 1 and "fork" in mp.get_all_start_methods():
+            _parallel_nb = (self, data, self._tar_idx, chunk_size)
+            try:
+                with mp.get_context("fork").Pool(n_jobs) as _pool:
+                    _statistics = _pool.map(_nb_chunk_statistics, _starts)
+            finally:
+                _parallel_nb = None
+        else:
+            _statistics = [self._data_statistics(data[i:i + chunk_size], self._tar_idx) for i in _starts]
+        self._set_statistics(reduce(self._merge_statistics, _statistics))
+        self._drop_data()
+        self._custom_func = False
+        self._func = self._fit(lb)
+
+    def _log_likelihood(self, x):
+        """ log p(x, c) of all rows & classes, shape = (len(x), n_category) """
+        raise NotImplementedError("Batch prediction is not implemented in {}".format(self))
+
     def predict_one(self, x, get_raw_result=False):
+        if self._vectorized and not self._custom_func:
+            return self.predict([x], get_raw_result)[0]
         m_arg, m_possibility = 0, 0
         for i in range(len(self._category)):
             p = self._func(x, i)
@@ -117,7 +217,22 @@ class NaiveBayes(metaclass=ABCMeta):
         return m_possibility
 
     def predict(self, x, get_raw_result=False):
-        return np.array([self.predict_one(xx, get_raw_result) for xx in x])
+        """
+        :param get_raw_result: return p(x, c) of the predicted class of every row instead of the class
+        """
+        if not self._vectorized or self._custom_func:
+            return np.array([self.predict_one(xx, get_raw_result) for xx in x])
+        _log_p = self._log_likelihood(x)
+        if get_raw_result:
+            return np.exp(np.max(_log_p, axis=1))
+        return np.argmax(_log_p, axis=1)
+
+    def predict_proba(self, x):
+        """ p(c|x) of all classes, shape = (len(x), n_category) """
+        if not self._vectorized or self._custom_func:
+            _p = np.array([[self._func(xx, i) for i in range(len(self._category))] for xx in x])
+            return _p / np.sum(_p, axis=1, keepdims=True)
+        return NBFunctions.normalize_log_probabilities(self._log_likelihood(x))
 
     @abstractmethod
     def estimate(self, data=None):
@@ -132,74 +247,166 @@ class NaiveBayes(metaclass=ABCMeta):
 
 class MultinomialNB(NaiveBayes):
 
-    def __init__(self):
+    _vectorized = True
+
+    def __init__(self, n_buckets=None):
+        """
+        :param n_buckets: None or number of buckets which the values of every feature are hashed into,
+                          so that count tables have a fixed size & no vocabulary of features is kept
+        """
         NaiveBayes.__init__(self)
+        self._n_buckets = n_buckets
+        self._log_tables = None
+        self._flat_codes = None
+
+    def _get_encoder(self, tar_idx):
+        if self._n_buckets is None:
+            return CategoricalEncoder()
+        return HashingEncoder(self._n_buckets, exact_columns=(tar_idx,))
 
     def feed_data(self, data, tar_idx=-1):
-        tar_idx = int(tar_idx)
-        attr_len = len(data[0])
-        if tar_idx < 0:
-            tar_idx = max(0, attr_len + tar_idx)
-        features = np.array(data).T
-        features = [set(feat) for feat in features]
-        categories = [{_l: i for i, _l in enumerate(feats)} for feats in features]
-        x = [[categories[i][_l] for i, _l in enumerate(line)] for line in data]
-        y = [xx.pop(tar_idx) for xx in x]
-        category = Counter(y)
-        n_possibilities = [len(counter) for counter in features]
-        n_possibilities.pop()
-
-        x, y = np.array(x), np.array(y)
-        labels = [y == value for value in set(y)]
-        labelled_x = [x[ci].T for ci in labels]
+        tar_idx = self._get_tar_idx(tar_idx, len(data[0]))
+        encoder = self._get_encoder(tar_idx)
+        codes = encoder.fit_transform(np.array(data))
+        vocabularies = list(encoder["vocabularies"])
+        labels = vocabularies.pop(tar_idx)
 
         self._tar_idx = tar_idx
-        self._x, self._y = x, y
-        self._labelled_x, self._label_zip = labelled_x, list(zip(labels, labelled_x))
-        self._category, self._categories, self._n_possibilities = category, categories, n_possibilities
+        self._x, self._y = np.delete(codes, tar_idx, axis=1), codes[:, tar_idx]
+        self._encoder = encoder
+        self._n_possibilities = list(np.delete(encoder.n_values, tar_idx))
+        self._flat_codes = self._get_flat_codes(self._x, self._y, self._n_possibilities, len(labels))
+        self._statistics = {"tar_idx": tar_idx, "labels": labels, "vocabularies": vocabularies}
         self.feed_sample_weight()
         self._initialized = True
 
     def feed_sample_weight(self, sample_weight=None):
-        self._category_info = []
-        for dim, _p in enumerate(self._n_possibilities):
-            if sample_weight is None:
-                self._category_info.append([
-                    np.bincount(xx[dim], minlength=_p) for xx in self._labelled_x])
+        if self._flat_codes is None:
+            raise ValueError("Sample weights need the data of 'feed_data', which is dropped after merging statistics")
+        if sample_weight is not None:
+            sample_weight = sample_weight * len(sample_weight)
+        counts, class_counts = self._count_flat_codes(
+            self._flat_codes, self._y, self._n_possibilities, len(self._statistics["labels"]), sample_weight)
+        self._statistics = dict(self._statistics, counts=counts, class_counts=class_counts)
+        self._category = Counter(dict(enumerate(class_counts)))
+
+    def _drop_data(self):
+        NaiveBayes._drop_data(self)
+        self._flat_codes = None
+
+    @staticmethod
+    def _get_flat_codes(x, y, n_possibilities, n_category):
+        """
+        Position of every (dim, value, class) of the data in a count table
+        of shape = (n_dim, max(n_possibilities), n_category), all rows of dim 0 come first
+        """
+        x = x.astype(np.intp)
+        return ((np.arange(x.shape[1]) * max(n_possibilities, default=0) + x) * n_category +
+                y.astype(np.intp)[:, None]).T.ravel()
+
+    @staticmethod
+    def _count_flat_codes(flat_codes, y, n_possibilities, n_category, sample_weight=None):
+        """
+        Weighted counts of all (dim, value, class) by one bincount over flat codes
+        :return: (counts, class_counts) -> counts[dim].shape = (n_possibilities[dim], n_category)
+        """
+        n_dim, n_max = len(n_possibilities), max(n_possibilities, default=0)
+        counts = np.bincount(
+            flat_codes, weights=None if sample_weight is None else np.tile(sample_weight, n_dim),
+            minlength=n_dim * n_max * n_category
+        ).astype(np.double).reshape(n_dim, n_max, n_category)
+        return ([counts[dim, :_p] for dim, _p in enumerate(n_possibilities)],
+                np.bincount(y.astype(np.intp), weights=sample_weight, minlength=n_category).astype(np.double))
+
+    def _data_statistics(self, data, tar_idx, sample_weight=None):
+        """
+            counts[dim]:   weighted count of every (value, class), shape = (n_possibilities[dim], n_category)
+            class_counts:  weighted count of every class
+            vocabularies:  vocabulary of every feature, None if it is hashed
+        """
+        encoder = self._get_encoder(tar_idx)
+        codes = encoder.fit_transform(data)
+        vocabularies = list(encoder["vocabularies"])
+        labels = vocabularies.pop(tar_idx)
+        x, y = np.delete(codes, tar_idx, axis=1), codes[:, tar_idx]
+        n_possibilities = list(np.delete(encoder.n_values, tar_idx))
+        counts, class_counts = self._count_flat_codes(
+            self._get_flat_codes(x, y, n_possibilities, len(labels)), y, n_possibilities, len(labels), sample_weight)
+        return {
+            "tar_idx": tar_idx, "labels": labels, "vocabularies": vocabularies,
+            "counts": counts, "class_counts": class_counts
+        }
+
+    @staticmethod
+    def _merge_statistics(statistics1, statistics2):
+        labels, (l1, l2) = NBFunctions.merge_values(statistics1["labels"], statistics2["labels"])
+        vocabularies, counts = [], []
+        for v1, v2, c1, c2 in zip(statistics1["vocabularies"], statistics2["vocabularies"],
+                                  statistics1["counts"], statistics2["counts"]):
+            if v1 is None:
+                # Hashed feature, buckets are the same in every chunk
+                _vocabulary, (p1, p2) = None, (np.arange(len(c1)), np.arange(len(c2)))
             else:
-                local_weight = sample_weight * len(sample_weight)
-                self._category_info.append([
-                    np.bincount(xx[dim], weights=local_weight[label], minlength=_p)
-                    for label, xx in self._label_zip])
+                _vocabulary, (p1, p2) = NBFunctions.merge_values(v1, v2)
+            _counts = np.zeros((len(c1) if _vocabulary is None else len(_vocabulary), len(labels)))
+            _counts[np.ix_(p1, l1)] += c1
+            _counts[np.ix_(p2, l2)] += c2
+            vocabularies.append(_vocabulary)
+            counts.append(_counts)
+        class_counts = np.zeros(len(labels))
+        class_counts[l1] += statistics1["class_counts"]
+        class_counts[l2] += statistics2["class_counts"]
+        return {
+            "tar_idx": statistics1["tar_idx"], "labels": labels, "vocabularies": vocabularies,
+            "counts": counts, "class_counts": class_counts
+        }
+
+    def _set_statistics(self, statistics):
+        NaiveBayes._set_statistics(self, statistics)
+        vocabularies = list(statistics["vocabularies"])
+        vocabularies.insert(statistics["tar_idx"], statistics["labels"])
+        self._tar_idx = statistics["tar_idx"]
+        self._encoder = self._get_encoder(self._tar_idx).set_vocabularies(vocabularies)
+        self._n_possibilities = list(np.delete(self._encoder.n_values, self._tar_idx))
+        self._category = Counter(dict(enumerate(statistics["class_counts"])))
 
     def _fit(self, lb):
+        """
+            self._log_tables:  log p(x_dim = value | c), shape = (n_dim, max(n_possibilities) + 1, n_category),
+                               value = n_possibilities[dim] is the unknown bucket (tables are padded after it)
+            self._log_prior:   log p(c)
+        """
         n_category = len(self._category)
-        n_dim = len(self._n_possibilities)
-        p_category = self.get_prior_probability(lb)
-
-        data = [None for _ in range(n_dim)]
-        for dim, n_possibilities in enumerate(self._n_possibilities):
-            new_category = self._category_info[dim]
-            data[dim] = [[
-                (new_category[c][p] + lb) / (self._category[c] + lb * n_possibilities)
-                for p in range(n_possibilities)
-            ] for c in range(n_category)]
+        n_possibilities = np.array(self._n_possibilities, dtype=np.intp)
+        counts = np.zeros((len(n_possibilities), max(self._n_possibilities, default=0) + 1, n_category))
+        for dim, _counts in enumerate(self._statistics["counts"]):
+            counts[dim, :len(_counts)] = _counts
+        category_counts = self._statistics["class_counts"]
+        self._log_tables = np.log(counts + lb) - np.log(category_counts + lb * n_possibilities[:, None, None])
+        self._log_prior = np.log(self.get_prior_probability(lb))
 
         def func(input_x, tar_category):
-            rs = 1
-            for d, _x in enumerate(input_x):
-                rs *= data[d][tar_category][_x]
-            return rs * p_category[tar_category]
+            return exp(self._log_likelihood([input_x])[0, tar_category])
 
         return func
 
+    def _log_likelihood(self, x, batch_size=1e6):
+        """
+        Gather log p(x_dim | c) of every row & dimension from self._log_tables in one fancy-index pass
+        (x is cut into batches of about batch_size gathered values)
+        """
+        n_dim, _, n_category = self._log_tables.shape
+        x = np.minimum(np.atleast_2d(np.asarray(x)).astype(np.intp), np.array(self._n_possibilities, dtype=np.intp))
+        dims = np.arange(n_dim)
+        rs = np.empty((len(x), n_category))
+        single_batch = max(1, int(batch_size / max(1, n_dim * n_category)))
+        for i in range(0, len(x), single_batch):
+            rs[i:i + single_batch] = np.sum(self._log_tables[dims, x[i:i + single_batch]], axis=1)
+        return rs + self._log_prior
+
     def get_xy_from_data(self, data):
-        x = data
-        y = [self._categories[-1][xx.pop(self._tar_idx)] for xx in x]
-        for i, line in enumerate(x):
-            for j, char in enumerate(line):
-                x[i][j] = self._categories[j][char]
-        return x, y
+        codes = self._encoder.transform(np.array(data))
+        return np.delete(codes, self._tar_idx, axis=1), codes[:, self._tar_idx]
 
     def estimate(self, data=None):
         if data is None:
@@ -212,123 +419,244 @@ class MultinomialNB(NaiveBayes):
 
 class GaussianNB(NaiveBayes):
 
+    _vectorized = True
+
     def __init__(self):
         NaiveBayes.__init__(self)
+        self._mu = self._var = self._log_norm = None
+        self._class_codes = self._moment_codes = None
 
     def feed_data(self, data, tar_idx=-1):
-        tar_idx = int(tar_idx)
-        attr_len = len(data[0])
-        if tar_idx < 0:
-            tar_idx = max(0, attr_len + tar_idx)
-        x = [list(map(lambda c: float(c), line)) for line in data]
-        y = [int(xx.pop(tar_idx)) for xx in x]
-        labels = sorted(list(set(y)))
-        category = Counter(y)
-
-        x, y = np.array(x), np.array(y)
-        labels = [y == label for label in labels]
-        labelled_x = [x[ci].T for ci in labels]
-
-        self._tar_idx = tar_idx
-        self._x, self._y = x, y
-        self._labelled_x, self._label_zip = labelled_x, labels
-        self._category = category
+        self._tar_idx = self._get_tar_idx(tar_idx, len(data[0]))
+        self._x, self._y = self.get_xy_from_data(data)
+        labels, class_codes = np.unique(self._y, return_inverse=True)
+        self._class_codes = class_codes.ravel()
+        self._moment_codes = self._get_moment_codes(self._class_codes, self._x.shape[1])
+        self._statistics = {"labels": labels}
         self.feed_sample_weight()
         self._initialized = True
 
     def feed_sample_weight(self, sample_weight=None):
+        if self._class_codes is None:
+            raise ValueError("Sample weights need the data of 'feed_data', which is dropped after merging statistics")
         if sample_weight is not None:
-            local_weight = sample_weight * len(sample_weight)
-            for i, label in enumerate(self._label_zip):
-                self._labelled_x[i] *= local_weight[label]
+            sample_weight = sample_weight * len(sample_weight)
+        self._set_statistics(dict(self._statistics, **self._weighted_moments(
+            self._x, self._class_codes, len(self._statistics["labels"]), sample_weight, self._moment_codes)))
+
+    def _drop_data(self):
+        NaiveBayes._drop_data(self)
+        self._class_codes = self._moment_codes = None
+
+    @staticmethod
+    def _get_moment_codes(class_codes, n_dim):
+        """ Position of every (class, dim) of the data in a moment matrix of shape = (n_category, n_dim) """
+        return (class_codes[:, None] * n_dim + np.arange(n_dim)).ravel()
+
+    @staticmethod
+    def _weighted_moments(x, class_codes, n_category, sample_weight=None, moment_codes=None):
+        """
+            class_counts:  weighted count of every class
+            means:         weighted mean of x of every class & dimension,                  shape = (n_category, n_dim)
+            m2:            weighted sum of (x - mean) ** 2 of every class & dimension,     shape = (n_category, n_dim)
+            (m2 is computed from deviations instead of sum(x ** 2) - n * mean ** 2, which loses precision
+             when the mean is large compared with the spread)
+        """
+        n_dim = x.shape[1]
+        if sample_weight is None:
+            sample_weight = np.ones(len(x))
+        if moment_codes is None:
+            moment_codes = GaussianNB._get_moment_codes(class_codes, n_dim)
+        class_counts = np.bincount(class_codes, weights=sample_weight, minlength=n_category)
+        sums = np.bincount(
+            moment_codes, weights=(sample_weight[:, None] * x).ravel(), minlength=n_category * n_dim)
+        means = sums.reshape(n_category, n_dim) / np.maximum(class_counts, 1e-300)[:, None]
+        deviations = x - means[class_codes]
+        m2 = np.bincount(
+            moment_codes, weights=(sample_weight[:, None] * deviations ** 2).ravel(), minlength=n_category * n_dim)
+        return {"class_counts": class_counts, "means": means, "m2": m2.reshape(n_category, n_dim)}
+
+    @staticmethod
+    def _get_statistics(x, y, sample_weight=None):
+        """ Weighted moments of x (see '_weighted_moments') & labels (sorted distinct values of y) """
+        labels, class_codes = np.unique(y, return_inverse=True)
+        return dict(labels=labels, **GaussianNB._weighted_moments(x, class_codes.ravel(), len(labels), sample_weight))
+
+    def _data_statistics(self, data, tar_idx, sample_weight=None):
+        x = np.asarray(data, dtype=np.double)
+        return self._get_statistics(np.delete(x, tar_idx, axis=1), x[:, tar_idx].astype(int), sample_weight)
+
+    @staticmethod
+    def _merge_statistics(statistics1, statistics2):
+        """ Moments of both parts are combined with Chan's parallel formula """
+        labels, positions = NBFunctions.merge_values(statistics1["labels"], statistics2["labels"])
+        n_dim = statistics1["means"].shape[1]
+        counts, means, m2 = [], [], []
+        for statistics, _positions in zip((statistics1, statistics2), positions):
+            _counts, _means, _m2 = np.zeros(len(labels)), np.zeros((len(labels), n_dim)), np.zeros((len(labels), n_dim))
+            _counts[_positions], _means[_positions], _m2[_positions] = (
+                statistics["class_counts"], statistics["means"], statistics["m2"])
+            counts.append(_counts[:, None])
+            means.append(_means)
+            m2.append(_m2)
+        total = counts[0] + counts[1]
+        _safe_total = np.maximum(total, 1e-300)
+        delta = means[1] - means[0]
+        return {
+            "labels": labels,
+            "class_counts": total.ravel(),
+            "means": means[0] + delta * counts[1] / _safe_total,
+            "m2": m2[0] + m2[1] + delta ** 2 * counts[0] * counts[1] / _safe_total
+        }
+
+    def _set_statistics(self, statistics):
+        NaiveBayes._set_statistics(self, statistics)
+        self._category = Counter(dict(enumerate(statistics["class_counts"])))
 
     def _fit(self, lb):
-        n_category = len(self._category)
-        n_dim = self._x.shape[1]
-        p_category = self.get_prior_probability(lb)
-        data = [
-            NBFunctions.gaussian_maximum_likelihood(
-                self._labelled_x, n_category, dim) for dim in range(n_dim)]
+        """
+            self._mu:        mean of every class & dimension,      shape = (n_category, n_dim)
+            self._var:       variance of every class & dimension,  shape = (n_category, n_dim)
+                             (a tiny fraction of the largest variance is added to avoid dividing by 0)
+            self._log_norm:  sum over dimensions of log(1 / sqrt(2π * var)),  shape = (n_category,)
+            self._log_prior: log p(c)
+        """
+        self._mu = self._statistics["means"]
+        self._var = self._statistics["m2"] / self._statistics["class_counts"][:, None]
+        self._var += 1e-9 * max(np.max(self._var, initial=0), 1)
+        self._log_norm = -0.5 * np.sum(np.log(2 * np.pi * self._var), axis=1)
+        self._log_prior = np.log(self.get_prior_probability(lb))
 
         def func(input_x, tar_category):
-            rs = 1
-            for d, _x in enumerate(input_x):
-                rs *= data[d][tar_category](_x)
-            return rs * p_category[tar_category]
+            return exp(self._log_likelihood([input_x])[0, tar_category])
 
         return func
 
+    def _log_likelihood(self, x, batch_size=1e6):
+        """
+        log p(x | c) = log_norm[c] - 0.5 * sum((x - mu[c]) ** 2 / var[c]), broadcasted over (rows, classes, dims)
+        (x is cut into batches of about batch_size broadcasted values)
+        """
+        n_category, n_dim = self._mu.shape
+        x = np.atleast_2d(np.asarray(x, dtype=np.double))
+        rs = np.empty((len(x), n_category))
+        single_batch = max(1, int(batch_size / max(1, n_dim * n_category)))
+        for i in range(0, len(x), single_batch):
+            _diff = x[i:i + single_batch, None, :] - self._mu
+            rs[i:i + single_batch] = self._log_norm - 0.5 * np.sum(_diff ** 2 / self._var, axis=2)
+        return rs + self._log_prior
+
+    def get_xy_from_data(self, data):
+        x = np.asarray(data, dtype=np.double)
+        return np.delete(x, self._tar_idx, axis=1), x[:, self._tar_idx].astype(int)
+
     def estimate(self, data=None):
         if data is None:
             x, y = self._x, self._y
         else:
-            x = [list(map(lambda c: float(c), line)) for line in data]
-            y = [int(xx.pop(self._tar_idx)) for xx in x]
+            x, y = self.get_xy_from_data(data)
         y_pred = self.predict(x)
         print("Acc             : {:12.6} %".format(100 * np.sum(y_pred == y) / len(y)))
 
 
 class MergedNB(NaiveBayes):
 
-    def __init__(self, whether_discrete):
+    _vectorized = True
+
+    def __init__(self, whether_discrete, n_buckets=None):
+        """
+        :param n_buckets: None or number of buckets which discrete features are hashed into (see MultinomialNB)
+        """
         NaiveBayes.__init__(self)
         self._whether_discrete = np.array(whether_discrete)
         self._whether_continuous = ~self._whether_discrete
-        self._multinomial, self._gaussian = MultinomialNB(), GaussianNB()
+        self._multinomial, self._gaussian = MultinomialNB(n_buckets), GaussianNB()
         self._discrete_data, self._continuous_data = None, None
 
     @property
     def data(self):
-        discrete_data = self._discrete_data.copy()
-        _categories = self._multinomial["categories"]
-        for i, line in enumerate(discrete_data):
-            for j, _l in enumerate(line):
-                discrete_data[i][j] = _categories[j][_l]
-        return np.hstack((self._continuous_data.astype(np.double), discrete_data.astype(np.int)))
+        discrete_data = self._multinomial["encoder"].transform(self._discrete_data)
+        return np.hstack((self._continuous_data.astype(np.double), discrete_data))
 
     def feed_data(self, data, tar_idx=-1):
         data = np.array(data)
         self._discrete_data, self._continuous_data = (
             data[:, self._whether_discrete], data[:, self._whether_continuous])
-        _y = np.array([list(dd).pop(tar_idx) for dd in self._discrete_data])
         self._multinomial.feed_data(self._discrete_data, tar_idx)
-        _y_category = self._multinomial["categories"][np.sum(self._whether_discrete)-1]
-        _y = np.array([_y_category[yy] for yy in _y])
-        self._category = Counter(_y)
+        _y = self._multinomial["y"]
         self._gaussian.feed_data(np.hstack((self._continuous_data, _y[:, None])), tar_idx)
-        self._initialized = True
+        # GaussianNB is fed with class codes, which are positions in the labels of MultinomialNB
+        multinomial_statistics = self._multinomial["statistics"]
+        self._set_statistics({
+            "multinomial": multinomial_statistics,
+            "gaussian": dict(self._gaussian["statistics"], labels=multinomial_statistics["labels"])
+        })
 
     def feed_sample_weight(self, sample_weight=None):
         self._multinomial.feed_sample_weight(sample_weight)
         self._gaussian.feed_sample_weight(sample_weight)
+        self._statistics = {"multinomial": self._multinomial["statistics"], "gaussian": self._gaussian["statistics"]}
+        self._category = self._multinomial["category"]
+
+    def copy(self):
+        rs = NaiveBayes.copy(self)
+        rs._multinomial, rs._gaussian = self._multinomial.copy(), self._gaussian.copy()
+        return rs
+
+    def _data_statistics(self, data, tar_idx, sample_weight=None):
+        """ Target should be the last column & discrete """
+        discrete_data = data[:, self._whether_discrete]
+        return {
+            "multinomial": self._multinomial["data_statistics"](
+                discrete_data, discrete_data.shape[1] - 1, sample_weight),
+            "gaussian": GaussianNB._get_statistics(
+                data[:, self._whether_continuous].astype(np.double), discrete_data[:, -1], sample_weight)
+        }
+
+    @staticmethod
+    def _merge_statistics(statistics1, statistics2):
+        return {
+            "multinomial": MultinomialNB._merge_statistics(statistics1["multinomial"], statistics2["multinomial"]),
+            "gaussian": GaussianNB._merge_statistics(statistics1["gaussian"], statistics2["gaussian"])
+        }
+
+    def _set_statistics(self, statistics):
+        NaiveBayes._set_statistics(self, statistics)
+        self._multinomial["set_statistics"](statistics["multinomial"])
+        self._gaussian["set_statistics"](statistics["gaussian"])
+        self._category = self._multinomial["category"]
+
+    def _drop_data(self):
+        self._discrete_data, self._continuous_data = None, None
+        self._multinomial["drop_data"]()
+        self._gaussian["drop_data"]()
 
     def _fit(self, lb):
-        self._multinomial.fit()
-        self._gaussian.fit()
-        discrete_func, continuous_func = self._multinomial["func"], self._gaussian["func"]
+        self._multinomial.fit(lb=lb)
+        self._gaussian.fit(lb=lb)
+        self._log_prior = self._multinomial["log_prior"]
 
         def func(input_x, tar_category):
-            input_x = np.array(input_x)
-            return discrete_func(
-                input_x[self._whether_discrete[:-1]].astype(np.int), tar_category) * continuous_func(
-                input_x[self._whether_continuous[:-1]], tar_category)
+            return exp(self._log_likelihood([input_x])[0, tar_category])
 
         return func
 
+    def _log_likelihood(self, x):
+        """ Both parts contain log p(c), so it is subtracted once from their sum """
+        x = np.atleast_2d(np.asarray(x, dtype=np.double))
+        return (
+            self._multinomial["log_likelihood"](x[:, self._whether_discrete[:-1]]) +
+            self._gaussian["log_likelihood"](x[:, self._whether_continuous[:-1]]) - self._log_prior
+        )
+
     def estimate(self, data=None):
         if data is None:
-            data = np.zeros((self._discrete_data.shape[0],
-                             self._discrete_data.shape[1] + self._continuous_data.shape[1]))
             _d, _c = self._discrete_data, self._continuous_data
         else:
             data = np.array(data)
             _d, _c = data[:, self._whether_discrete], data[:, self._whether_continuous]
-        _categories = self._multinomial["categories"]
-        for i, line in enumerate(_d):
-            for j, char in enumerate(line):
-                _d[i][j] = _categories[j][char]
-        data = np.zeros(data.shape)
-        data[:, self._whether_discrete] = _d.astype(np.int)
+        data = np.zeros((len(_d), _d.shape[1] + _c.shape[1]))
+        data[:, self._whether_discrete] = self._multinomial["encoder"].transform(_d)
         data[:, self._whether_continuous] = _c.astype(np.double)
         y, y_pred = self.predict(data[:, range(data.shape[1]-1)]), data[:, -1]
         rs = np.sum(y == y_pred)
@@ -0,0 +1,227 @@
+import numpy as np
+
+
+class CategoricalEncoder:
+    """
+        Vectorized categorical encoder shared by CvDTree, NaiveBayes & AdaBoost loaders
+            fit       : vocabularies[i] = sorted distinct values of column i
+            transform : codes[j, i] = position of x[j, i] in vocabularies[i],
+                        unseen values go to the unknown bucket (code = len(vocabularies[i]))
+        Codes are stored in the smallest integer type which holds every code (int8 / int16 / int32)
+    """
+
+    def __init__(self):
+        self._vocabularies = None
+        self._dtype = None
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return getattr(self, "_" + item)
+        return
+
+    @property
+    def n_values(self):
+        """ Number of known values of every column (the unknown bucket excluded) """
+        return np.array([len(_vocabulary) for _vocabulary in self._vocabularies], dtype=np.intp)
+
+    @staticmethod
+    def _get_dtype(max_code):
+        for _dtype in (np.int8, np.int16):
+            if max_code <= np.iinfo(_dtype).max:
+                return _dtype
+        return np.int32
+
+    @staticmethod
+    def _to_2d(x):
+        x = np.asarray(x)
+        return (x[:, None], True) if x.ndim == 1 else (x, False)
+
+    def fit(self, x):
+        self.fit_transform(x)
+        return self
+
+    def fit_transform(self, x):
+        """
+        :param x: raw data, shape = (n_samples, n_features) or (n_samples,)
+        :return:  codes, same shape as x
+        """
+        x, _flat = self._to_2d(x)
+        self._vocabularies, _codes = [], []
+        for column in x.T:
+            _vocabulary, _code = np.unique(column, return_inverse=True)
+            self._vocabularies.append(_vocabulary)
+            _codes.append(_code.ravel())
+        self._dtype = self._get_dtype(max([len(_vocabulary) for _vocabulary in self._vocabularies] + [0]))
+        _codes = np.array(_codes, dtype=self._dtype).reshape(x.shape[1], len(x)).T
+        return _codes[:, 0] if _flat else _codes
+
+    def set_vocabularies(self, vocabularies):
+        """ Use given sorted vocabularies (e.g. merged from several chunks) instead of fitting them """
+        self._vocabularies = [np.asarray(_vocabulary) for _vocabulary in vocabularies]
+        self._dtype = self._get_dtype(max([len(_vocabulary) for _vocabulary in self._vocabularies] + [0]))
+        return self
+
+    def transform(self, x):
+        x, _flat = self._to_2d(x)
+        if x.shape[1] != len(self._vocabularies):
+            raise ValueError("Encoder was fitted on {} columns, {} found".format(len(self._vocabularies), x.shape[1]))
+        _codes = np.empty(x.shape, dtype=self._dtype)
+        for i, (column, _vocabulary) in enumerate(zip(x.T, self._vocabularies)):
+            _codes[:, i] = self._encode_column(column, _vocabulary)
+        return _codes[:, 0] if _flat else _codes
+
+    def _encode_column(self, column, vocabulary):
+        if not len(vocabulary):
+            return 0
+        _code = np.minimum(np.searchsorted(vocabulary, column), len(vocabulary) - 1)
+        return np.where(vocabulary[_code] == column, _code, len(vocabulary))
+
+    def inverse_transform(self, codes):
+        """ Unknown buckets are mapped back to None """
+        codes, _flat = self._to_2d(codes)
+        _x = np.empty(codes.shape, dtype=object)
+        for i, (_code, _vocabulary) in enumerate(zip(codes.T, self._vocabularies)):
+            _known = _code < len(_vocabulary)
+            _x[_known, i] = _vocabulary[_code[_known]]
+            _x[~_known, i] = None
+        return _x[:, 0] if _flat else _x
+
+
+class HashingEncoder(CategoricalEncoder):
+    """
+        Categorical encoder which holds no vocabulary for (high-cardinality) hashed columns
+            hashed columns : codes[j, i] = FNV-1a hash of str(x[j, i]) % n_buckets
+            exact columns  : encoded by vocabularies as in CategoricalEncoder (e.g. the label column)
+        Vocabularies of hashed columns are None, values hashed into one bucket (seen or not) share it
+    """
+
+    FNV_OFFSET, FNV_PRIME = np.uint64(14695981039346656037), np.uint64(1099511628211)
+
+    def __init__(self, n_buckets, exact_columns=()):
+        CategoricalEncoder.__init__(self)
+        self._n_buckets = n_buckets
+        self._exact_columns = set(exact_columns)
+
+    @property
+    def n_values(self):
+        """ Number of known values of every exact column & n_buckets of every hashed column """
+        return np.array([
+            self._n_buckets if _vocabulary is None else len(_vocabulary) for _vocabulary in self._vocabularies
+        ], dtype=np.intp)
+
+    @staticmethod
+    def hash_values(column, n_buckets):
+        """
+        64-bit FNV-1a hash of the code points of str(value) of every value (same as FNV-1a of bytes for ASCII),
+        vectorized over values with one pass per character position
+        """
+        _str = np.ascontiguousarray(np.asarray(column).astype(str))
+        _h = np.full(len(_str), HashingEncoder.FNV_OFFSET, dtype=np.uint64)
+        _width = _str.dtype.itemsize // 4
+        if _width and len(_str):
+            _lengths = np.char.str_len(_str)
+            _chars = _str.view(np.uint32).reshape(len(_str), _width)
+            for j in range(_width):
+                # str arrays are NUL padded up to the longest value, so shorter values are left as they are
+                _h = np.where(j < _lengths, (_h ^ _chars[:, j]) * HashingEncoder.FNV_PRIME, _h)
+        return _h % np.uint64(n_buckets)
+
+    def fit_transform(self, x):
+        x, _flat = self._to_2d(x)
+        self.set_vocabularies([
+            np.unique(column) if i in self._exact_columns else None for i, column in enumerate(x.T)])
+        return self.transform(x[:, 0] if _flat else x)
+
+    def set_vocabularies(self, vocabularies):
+        """ None marks a hashed column """
+        self._vocabularies = [None if _vocabulary is None else np.asarray(_vocabulary) for _vocabulary in vocabularies]
+        self._dtype = self._get_dtype(max(list(self.n_values) + [0]))
+        return self
+
+    def _encode_column(self, column, vocabulary):
+        if vocabulary is None:
+            return self.hash_values(column, self._n_buckets)
+        return CategoricalEncoder._encode_column(self, column, vocabulary)
+
+    def inverse_transform(self, codes):
+        """ Values of hashed columns can not be recovered & are mapped to None """
+        codes, _flat = self._to_2d(codes)
+        _x = np.empty(codes.shape, dtype=object)
+        for i, _vocabulary in enumerate(self._vocabularies):
+            if _vocabulary is not None:
+                _x[:, i] = CategoricalEncoder().set_vocabularies([_vocabulary]).inverse_transform(codes[:, i])
+        return _x[:, 0] if _flat else _x
+
+
+class ContinuousEncoder(CategoricalEncoder):
+    """
+        Categorical encoder which also codes continuous columns by bins
+            continuous columns : vocabularies[i] = sorted edges between bins (see 'get_edges'),
+                                 codes[j, i] = number of edges < x[j, i] (every value falls into a bin)
+            discrete columns   : encoded by vocabularies as in CategoricalEncoder
+    """
+
+    def __init__(self, whether_continuous=None, n_bins=None):
+        """
+        :param whether_continuous: whether_continuous[i] = True if column i is continuous (None -> all discrete)
+        :param n_bins:             continuous columns are quantised into at most n_bins bins (None -> one bin
+                                   per distinct value)
+        """
+        CategoricalEncoder.__init__(self)
+        self._whether_continuous = None if whether_continuous is None else np.asarray(whether_continuous, dtype=bool)
+        self._n_bins = n_bins
+
+    @property
+    def n_values(self):
+        """ Number of known values of every discrete column & number of bins of every continuous column """
+        return np.array([
+            len(_vocabulary) + int(_continuous)
+            for _vocabulary, _continuous in zip(self._vocabularies, self._whether_continuous)
+        ], dtype=np.intp)
+
+    @staticmethod
+    def get_edges(column, n_bins=None):
+        """ Midpoints between distinct values, or percentiles if there are more than n_bins distinct values """
+        column = np.asarray(column, dtype=np.float64)
+        _values = np.unique(column)
+        if n_bins is None or len(_values) <= n_bins:
+            return (_values[1:] + _values[:-1]) / 2
+        return np.unique(np.percentile(column, np.linspace(0, 100, n_bins + 1)[1:-1]))
+
+    def fit_transform(self, x):
+        x, _flat = self._to_2d(x)
+        if self._whether_continuous is None:
+            self._whether_continuous = np.zeros(x.shape[1], dtype=bool)
+        self.set_vocabularies([
+            self.get_edges(column, self._n_bins) if self._whether_continuous[i] else np.unique(column)
+            for i, column in enumerate(x.T)])
+        return self.transform(x[:, 0] if _flat else x)
+
+    def set_vocabularies(self, vocabularies):
+        """ Vocabularies of continuous columns are their edges """
+        if self._whether_continuous is None:
+            self._whether_continuous = np.zeros(len(vocabularies), dtype=bool)
+        self._vocabularies = [np.asarray(_vocabulary) for _vocabulary in vocabularies]
+        self._dtype = self._get_dtype(max(list(self.n_values) + [0]))
+        return self
+
+    def transform(self, x):
+        x, _flat = self._to_2d(x)
+        if x.shape[1] != len(self._vocabularies):
+            raise ValueError("Encoder was fitted on {} columns, {} found".format(len(self._vocabularies), x.shape[1]))
+        _codes = np.empty(x.shape, dtype=self._dtype)
+        for i, (column, _vocabulary) in enumerate(zip(x.T, self._vocabularies)):
+            if self._whether_continuous[i]:
+                _codes[:, i] = np.searchsorted(_vocabulary, column.astype(np.float64))
+            else:
+                _codes[:, i] = self._encode_column(column, _vocabulary)
+        return _codes[:, 0] if _flat else _codes
+
+    def inverse_transform(self, codes):
+        """ Bins of continuous columns can not be mapped back to values & are mapped to None """
+        codes, _flat = self._to_2d(codes)
+        _x = np.empty(codes.shape, dtype=object)
+        for i, _vocabulary in enumerate(self._vocabularies):
+            if not self._whether_continuous[i]:
+                _x[:, i] = CategoricalEncoder().set_vocabularies([_vocabulary]).inverse_transform(codes[:, i])
+        return _x[:, 0] if _flat else _x
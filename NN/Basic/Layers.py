@@ -472,6 +472,53 @@ class Softmax(Layer):
         return y * (1 - y)
 
 
+# Embedding Layer
+
+class Embedding(Layer):
+
+    LayerTiming = Timing()
+
+    def __init__(self, shape):
+        """
+        :param shape: shape[0] = number of categories (rows of the embedding table)
+                      shape[1] = units of current layer (self)
+        Input should be an integer matrix whose columns are category indices of each field
+        (offset so that different fields don't share indices). The output equals to the
+        dense product of the one-hot expanded input and the weight matrix
+        """
+        Layer.__init__(self, shape)
+
+    @LayerTiming.timeit(level=1, prefix="[Core] ")
+    def activate(self, x, w, bias=None, predict=False):
+        x = np.asarray(x, dtype=np.intp)
+        if len(x.shape) == 1:
+            x = x.reshape(-1, 1)
+        rs = w[x].sum(axis=1)
+        if bias is None:
+            return self._activate(rs, predict)
+        return self._activate(rs + bias, predict)
+
+    @LayerTiming.timeit(level=1, prefix="[Core] ")
+    def sparse_gradient(self, x, delta):
+        """
+        :return: rows -> indices of the rows present in current batch
+                 dw   -> gradients of these rows (scatter-added over the batch)
+        """
+        x = np.asarray(x, dtype=np.intp)
+        if len(x.shape) == 1:
+            x = x.reshape(-1, 1)
+        rows, inverse = np.unique(x, return_inverse=True)
+        dw = np.zeros((len(rows), delta.shape[1]))
+        np.add.at(dw, inverse.reshape(x.shape), delta[:, None, :])
+        return rows, dw
+
+    def _activate(self, x, predict):
+        return x
+
+    def _derivative(self, y, delta=None):
+        return 1
+
+
 # Convolution Layers
 
 class ConvTanh(ConvLayer, Tanh, metaclass=ConvLayerMeta):
@@ -789,6 +836,7 @@ class LayerFactory:
         "ELU": ELU, "ReLU": ReLU, "Softplus": Softplus,
         "Softmax": Softmax,
         "Identical": Identical,
+        "Embedding": Embedding,
         "ConvTanh": ConvTanh, "ConvSigmoid": ConvSigmoid,
         "ConvELU": ConvELU, "ConvReLU": ConvReLU, "ConvSoftplus": ConvSoftplus,
         "ConvSoftmax": ConvSoftmax,
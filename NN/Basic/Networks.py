@@ -12,6 +12,11 @@ from Basic.Layers import *
 from Basic.Optimizers import OptFactory
 from Util import ProgressBar, VisUtil
 
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
 np.random.seed(142857)  # for reproducibility
 
 
@@ -175,16 +180,36 @@ class NN:
             if self._y is None:
                 raise BuildNetworkError("Please provide input matrix")
             y = self._y
-        if len(x) != len(y):
+        if NN._is_sparse(x):
+            x = x.tocsr()
+            self._x_min, self._x_max = x.min(), x.max()
+        else:
+            self._x_min, self._x_max = np.min(x), np.max(x)
+        if x.shape[0] != len(y):
             raise BuildNetworkError("Data fed to network should be identical in length, x: {} and y: {} found".format(
-                len(x), len(y)
+                x.shape[0], len(y)
             ))
         self._x, self._y = x, y
-        self._x_min, self._x_max = np.min(x), np.max(x)
         self._y_min, self._y_max = np.min(y), np.max(y)
-        self._data_size = len(x)
+        self._data_size = x.shape[0]
         return x, y
 
+    @staticmethod
+    def _is_sparse(x):
+        return sp is not None and sp.issparse(x)
+
+    @staticmethod
+    def _to_array(x):
+        if NN._is_sparse(x):
+            return x.tocsr()
+        return np.array(x)
+
+    @staticmethod
+    def _vstack(x1, x2):
+        if NN._is_sparse(x1) or NN._is_sparse(x2):
+            return sp.vstack((x1, x2), format="csr")
+        return np.vstack((x1, x2))
+
     @NNTiming.timeit(level=4)
     def _add_weight(self, shape, conv_channel=None, fc_shape=None):
         if fc_shape is not None:
@@ -209,6 +234,8 @@ class NN:
         _parent = self._layers[-1]
         if isinstance(_parent, CostLayer):
             raise BuildLayerError("Adding layer after CostLayer is not permitted")
+        if isinstance(layer, Embedding) or layer == "Embedding":
+            raise BuildLayerError("Embedding layer should be the first layer")
         if isinstance(layer, str):
             layer, shape = self._layer_factory.get_layer_by_name(
                 layer, _parent, self._current_dimension, *args, **kwargs
@@ -276,13 +303,14 @@ class NN:
     def _get_prediction(self, x, name=None, batch_size=1e6, verbose=None):
         if verbose is None:
             verbose = self.verbose
+        x_len = x.shape[0]
         single_batch = int(batch_size / np.prod(x.shape[1:]))
         if not single_batch:
             single_batch = 1
-        if single_batch >= len(x):
+        if single_batch >= x_len:
             return self._get_activations(x, predict=True).pop()
-        epoch = int(len(x) / single_batch)
-        if not len(x) % single_batch:
+        epoch = int(x_len / single_batch)
+        if not x_len % single_batch:
             epoch += 1
         name = "Prediction" if name is None else "Prediction ({})".format(name)
         sub_bar = ProgressBar(min_value=0, max_value=epoch, name=name)
@@ -291,9 +319,9 @@ class NN:
         rs, count = [self._get_activations(x[:single_batch], predict=True).pop()], single_batch
         if verbose >= NNVerbose.METRICS:
             sub_bar.update()
-        while count < len(x):
+        while count < x_len:
             count += single_batch
-            if count >= len(x):
+            if count >= x_len:
                 rs.append(self._get_activations(x[count-single_batch:], predict=True).pop())
             else:
                 rs.append(self._get_activations(x[count-single_batch:count], predict=True).pop())
@@ -365,11 +393,21 @@ class NN:
 
     @NNTiming.timeit(level=1)
     def _opt(self, i, _activation, _delta):
-        if not isinstance(self._layers[i], ConvLayer):
+        if isinstance(self._layers[i], Embedding):
+            rows, dw = self._layers[i].sparse_gradient(_activation, _delta)
+            self._weights[i][rows] *= self._regularization_param
+            self._weights[i][rows] += self._w_optimizer.run_sparse(i, rows, dw)
+            if self._whether_apply_bias:
+                self._bias[i] += self._b_optimizer.run(
+                    i, np.sum(_delta, axis=0, keepdims=True)
+                )
+        elif not isinstance(self._layers[i], ConvLayer):
+            if NN._is_sparse(_activation):
+                dw = _activation.T.dot(_delta)
+            else:
+                dw = _activation.reshape(_activation.shape[0], -1).T.dot(_delta)
             self._weights[i] *= self._regularization_param
-            self._weights[i] += self._w_optimizer.run(
-                i, _activation.reshape(_activation.shape[0], -1).T.dot(_delta)
-            )
+            self._weights[i] += self._w_optimizer.run(i, dw)
             if self._whether_apply_bias:
                 self._bias[i] += self._b_optimizer.run(
                     i, np.sum(_delta, axis=0, keepdims=True)
@@ -483,21 +521,21 @@ class NN:
                    train_only, training_scale=NNConfig.TRAINING_SCALE):
         if train_only:
             if x_test is not None and y_test is not None:
-                x, y = np.vstack((x, x_test)), np.vstack((y, y_test))
-            x_train, y_train = np.array(x), np.array(y)
+                x, y = NN._vstack(x, x_test), np.vstack((y, y_test))
+            x_train, y_train = NN._to_array(x), np.array(y)
             x_test, y_test = x_train, y_train
         else:
-            shuffle_suffix = np.random.permutation(len(x))
+            shuffle_suffix = np.random.permutation(x.shape[0])
             x, y = x[shuffle_suffix], y[shuffle_suffix]
             if x_test is None or y_test is None:
-                train_len = int(len(x) * training_scale)
-                x_train, y_train = np.array(x[:train_len]), np.array(y[:train_len])
-                x_test, y_test = np.array(x[train_len:]), np.array(y[train_len:])
+                train_len = int(x.shape[0] * training_scale)
+                x_train, y_train = NN._to_array(x[:train_len]), np.array(y[:train_len])
+                x_test, y_test = NN._to_array(x[train_len:]), np.array(y[train_len:])
             elif x_test is None or y_test is None:
                 raise BuildNetworkError("Please provide test sets if you want to split data on your own")
             else:
-                x_train, y_train = np.array(x), np.array(y)
-                x_test, y_test = np.array(x_test), np.array(y_test)
+                x_train, y_train = NN._to_array(x), np.array(y)
+                x_test, y_test = NN._to_array(x_test), np.array(y_test)
         if NNConfig.BOOST_LESS_SAMPLES:
             if y_train.shape[1] != 2:
                 raise BuildNetworkError("It is not permitted to boost less samples in multiple classification")
@@ -509,9 +547,9 @@ class NN:
                 y0, y1 = y1, y0
                 y0_len = y_len - y0_len
             boost_suffix = np.random.randint(y0_len, size=y_len - y0_len)
-            x_train = np.vstack((x_train[y1], x_train[y0][boost_suffix]))
+            x_train = NN._vstack(x_train[y1], x_train[y0][boost_suffix])
             y_train = np.vstack((y_train[y1], y_train[y0][boost_suffix]))
-            shuffle_suffix = np.random.permutation(len(x_train))
+            shuffle_suffix = np.random.permutation(x_train.shape[0])
             x_train, y_train = x_train[shuffle_suffix], y_train[shuffle_suffix]
         return (x_train, x_test), (y_train, y_test)
 
@@ -555,6 +593,8 @@ class NN:
 
         if not self._layers:
             raise BuildNetworkError("Please provide layers before fitting data")
+        if NN._is_sparse(x) and isinstance(self._layers[0], ConvLayer):
+            raise BuildNetworkError("Sparse input is only supported when the first layer is not a ConvLayer")
         self._add_cost_layer()
 
         if y.shape[1] != self._current_dimension:
@@ -563,7 +603,7 @@ class NN:
 
         (x_train, x_test), (y_train, y_test) = self.split_data(
             x, y, x_test, y_test, train_only)
-        train_len = len(x_train)
+        train_len = x_train.shape[0]
         batch_size = min(batch_size, train_len)
         do_random_batch = train_len >= batch_size
         train_repeat = int(train_len / batch_size) + 1
@@ -755,14 +795,14 @@ class NN:
 
     @NNTiming.timeit(level=4, prefix="[API] ")
     def predict(self, x):
-        x = np.array(x)
+        x = NN._to_array(x)
         if len(x.shape) == 1:
             x = x.reshape(1, -1)
         return self._get_prediction(x)
 
     @NNTiming.timeit(level=4, prefix="[API] ")
     def predict_classes(self, x, flatten=True):
-        x = np.array(x)
+        x = NN._to_array(x)
         if len(x.shape) == 1:
             x = x.reshape(1, -1)
         if flatten:
@@ -33,6 +33,18 @@ class Optimizers(metaclass=ABCMeta):
     def _run(self, i, dw):
         raise NotImplementedError("Please implement a 'feed' method for your optimizer")
 
+    @OptTiming.timeit(level=1, prefix="[API] ")
+    def run_sparse(self, i, rows, dw):
+        """
+        Lazy update which only touches the given rows of variable i (and of its cache)
+        :param rows: indices of the rows to be updated
+        :param dw:   gradients of these rows
+        """
+        return self._run_sparse(i, rows, dw)
+
+    def _run_sparse(self, i, rows, dw):
+        raise NotImplementedError("Lazy row-sparse update is not implemented for {}".format(self.name))
+
     @OptTiming.timeit(level=4, prefix="[API] ")
     def update(self):
         return self._update()
@@ -53,6 +65,9 @@ class SGD(Optimizers):
     def _run(self, i, dw):
         return self.lr * dw
 
+    def _run_sparse(self, i, rows, dw):
+        return self.lr * dw
+
     def _update(self):
         pass
 
@@ -100,6 +115,11 @@ class Momentum(Optimizers):
         velocity[i] = velocity[i] * self._momentum + self.lr * dw
         return velocity[i]
 
+    def _run_sparse(self, i, rows, dw):
+        velocity = self._cache[i]
+        velocity[rows] = velocity[rows] * self._momentum + self.lr * dw
+        return velocity[rows]
+
     def _update(self):
         if self._momentum < self._ceiling:
             self._momentum += self._step
@@ -113,6 +133,12 @@ class NAG(Momentum):
         velocity[i] = self._momentum * velocity[i] + dw
         return self._momentum * velocity[i] + dw
 
+    def _run_sparse(self, i, rows, dw):
+        dw = self.lr * dw
+        velocity = self._cache[i]
+        velocity[rows] = self._momentum * velocity[rows] + dw
+        return self._momentum * velocity[rows] + dw
+
 
 class Adam(Optimizers):
 
@@ -131,6 +157,12 @@ class Adam(Optimizers):
         self._cache[1][i] = self._cache[1][i] * self.beta2 + (1 - self.beta2) * (dw ** 2)
         return self.lr * self._cache[0][i] / (np.sqrt(self._cache[1][i] + self.eps))
 
+    def _run_sparse(self, i, rows, dw):
+        m, v = self._cache[0][i], self._cache[1][i]
+        m[rows] = m[rows] * self.beta1 + (1 - self.beta1) * dw
+        v[rows] = v[rows] * self.beta2 + (1 - self.beta2) * (dw ** 2)
+        return self.lr * m[rows] / (np.sqrt(v[rows] + self.eps))
+
     def _update(self):
         pass
 
@@ -145,6 +177,11 @@ class RMSProp(Optimizers):
         self._cache[i] = self._cache[i] * self.decay_rate + (1 - self.decay_rate) * dw ** 2
         return self.lr * dw / (np.sqrt(self._cache[i] + self.eps))
 
+    def _run_sparse(self, i, rows, dw):
+        cache = self._cache[i]
+        cache[rows] = cache[rows] * self.decay_rate + (1 - self.decay_rate) * dw ** 2
+        return self.lr * dw / (np.sqrt(cache[rows] + self.eps))
+
     def _update(self):
         pass
 
@@ -0,0 +1,207 @@
+import time
+
+from Basic.Networks import *
+
+
+class QuantizedNN:
+    """
+        Post-training quantization (2 ~ 8 bits) of a fitted (numpy backend) NN
+        Weights of dense & conv layers are stored as int8 with per-channel scales,
+        inputs of these layers are quantized with per-layer scales calibrated on a sample of data,
+        matmul / im2col-conv run in float32 BLAS on the int8 values (float64 if float32 could not hold the
+        accumulation exactly) and are rescaled to float afterwards.
+        Other layers (SubLayers, pooling, Embedding) are run in float as usual
+        Sparse (scipy CSR) input is supported as in NN, its stored values are quantized
+    """
+
+    QNNTiming = Timing()
+
+    def __init__(self, nn, n_bits=8):
+        if not isinstance(nn, NN):
+            raise BuildNetworkError("QuantizedNN only supports numpy backend NN")
+        if not 2 <= n_bits <= 8:
+            raise BuildNetworkError("n_bits should be between 2 and 8, {} found".format(n_bits))
+        self._nn = nn
+        self._layers, self._bias = nn["layers"], nn["bias"]
+        self._float_weights = nn["weights"]
+        self._n_bits = n_bits
+        self._q_max = 2 ** (n_bits - 1) - 1
+        self._q_weights, self._w_scales, self._x_scales = [], [], []
+        self._mm_weights = []
+        self._calibrated = False
+
+    def __str__(self):
+        return "Quantized Neural Network"
+
+    __repr__ = __str__
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return getattr(self, "_" + item)
+        return
+
+    @property
+    def nbytes(self):
+        rs = 0
+        for i, (w, b) in enumerate(zip(self._float_weights, self._bias)):
+            if self._q_weights and self._q_weights[i] is not None:
+                rs += self._q_weights[i].nbytes + self._w_scales[i].nbytes
+            else:
+                rs += w.nbytes
+            rs += b.nbytes
+        return rs
+
+    @property
+    def float_nbytes(self):
+        return sum([w.nbytes + b.nbytes for w, b in zip(self._float_weights, self._bias)])
+
+    # Util
+
+    def _quantizable(self, layer):
+        return not isinstance(layer, (SubLayer, ConvPoolLayer, Embedding))
+
+    def _quantize(self, x, scale, dtype=np.int8):
+        # n_bits <= 8, so quantized values always fit in int8
+        return np.clip(np.round(x / scale), -self._q_max, self._q_max).astype(dtype)
+
+    def _get_mm_weights(self, q_w):
+        """ Weights (as matmul operand) in float32 if every sum of products of quantized values is exact in it """
+        n_terms = int(np.prod(q_w.shape[1:])) if q_w.ndim == 4 else q_w.shape[0]
+        dtype = np.float32 if n_terms * self._q_max ** 2 < 2 ** 24 else np.float64
+        if q_w.ndim == 4:
+            q_w = q_w.reshape(len(q_w), -1)
+        return q_w.astype(dtype)
+
+    def _get_scale(self, x, axis=None):
+        if NN._is_sparse(x):
+            x = x.data
+        scale = np.max(np.abs(x), axis=axis, initial=0) / self._q_max
+        return np.where(scale > 0, scale, 1)
+
+    @staticmethod
+    def _im2col(layer, x):
+        n, n_channels, height, width = x.shape
+        filter_height, filter_width = layer.shape[1][1:]
+        p, sd = layer.padding, layer.stride
+        x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+        height += 2 * p
+        width += 2 * p
+        shape = (n_channels, filter_height, filter_width, n, layer.out_h, layer.out_w)
+        strides = (height * width, width, 1, n_channels * height * width, sd * width, sd)
+        strides = x_padded.itemsize * np.array(strides)
+        return np.lib.stride_tricks.as_strided(x_padded, shape=shape, strides=strides).reshape(
+            n_channels * filter_height * filter_width, n * layer.out_h * layer.out_w)
+
+    # Core
+
+    @QNNTiming.timeit(level=1)
+    def _q_activate(self, i, x):
+        layer, mm_w, w_scale, x_scale = self._layers[i], self._mm_weights[i], self._w_scales[i], self._x_scales[i]
+        bias = self._bias[i]
+        if NN._is_sparse(x):
+            q_x = x.copy()
+            q_x.data = self._quantize(x.data, x_scale, mm_w.dtype)
+            return layer._activate(q_x.dot(mm_w) * (x_scale * w_scale) + bias, True)
+        q_x = self._quantize(x, x_scale, mm_w.dtype)
+        if isinstance(layer, ConvLayer):
+            n, n_filters = len(x), mm_w.shape[0]
+            x_cols = self._im2col(layer, q_x)
+            res = mm_w.dot(x_cols)
+            res = res * (x_scale * w_scale)[..., None] + bias.reshape(-1, 1)
+            res.shape = (n_filters, n, layer.out_h, layer.out_w)
+            # ConvLayers are built as (ConvLayer, ActivationLayer) by ConvMeta
+            return type(layer).__bases__[1]._activate(layer, res.transpose(1, 0, 2, 3), True)
+        if layer.is_fc:
+            q_x = q_x.reshape(len(q_x), -1)
+        res = q_x.dot(mm_w) * (x_scale * w_scale) + bias
+        return layer._activate(res, True)
+
+    @QNNTiming.timeit(level=1)
+    def _get_activations(self, x):
+        _activations = []
+        for i, layer in enumerate(self._layers):
+            if self._q_weights[i] is None:
+                x = layer.activate(x, self._float_weights[i], self._bias[i], predict=True)
+            else:
+                x = self._q_activate(i, x)
+            _activations.append(x)
+        return _activations
+
+    # API
+
+    @QNNTiming.timeit(level=4, prefix="[API] ")
+    def calibrate(self, x, sample_size=1000):
+        """
+        :param x:           data used for calibration (a random subset of it is used)
+        :param sample_size: number of samples used for calibration
+        """
+        x = NN._to_array(x)
+        if x.shape[0] > sample_size:
+            x = x[np.random.choice(x.shape[0], sample_size, replace=False)]
+        _activations = self._nn["get_activations"](x, predict=True)
+        _inputs = [x] + _activations[:-1]
+        self._q_weights, self._w_scales, self._x_scales, self._mm_weights = [], [], [], []
+        for layer, w, _input in zip(self._layers, self._float_weights, _inputs):
+            if not self._quantizable(layer):
+                self._q_weights.append(None)
+                self._mm_weights.append(None)
+                self._w_scales.append(None)
+                self._x_scales.append(None)
+                continue
+            if isinstance(layer, ConvLayer):
+                w_scale = self._get_scale(w.reshape(len(w), -1), axis=1)
+                self._q_weights.append(self._quantize(w, w_scale[:, None, None, None]))
+            else:
+                w_scale = self._get_scale(w, axis=0)
+                self._q_weights.append(self._quantize(w, w_scale))
+            self._mm_weights.append(self._get_mm_weights(self._q_weights[-1]))
+            self._w_scales.append(w_scale)
+            self._x_scales.append(self._get_scale(_input))
+        self._calibrated = True
+
+    @QNNTiming.timeit(level=4, prefix="[API] ")
+    def predict(self, x, batch_size=1e6):
+        if not self._calibrated:
+            raise BuildNetworkError("Please calibrate QuantizedNN before predicting")
+        x = NN._to_array(x)
+        if len(x.shape) == 1:
+            x = x.reshape(1, -1)
+        single_batch = max(1, int(batch_size / np.prod(x.shape[1:])))
+        return np.vstack([
+            self._get_activations(x[i:i + single_batch]).pop() for i in range(0, x.shape[0], single_batch)
+        ])
+
+    @QNNTiming.timeit(level=4, prefix="[API] ")
+    def predict_classes(self, x):
+        return np.argmax(self.predict(x), axis=1)
+
+    @QNNTiming.timeit(level=4, prefix="[API] ")
+    def evaluate(self, x, y, metrics=None):
+        """
+        :return: (float logs, quantized logs) -> metrics of the float model & of the quantized model
+        """
+        if metrics is None:
+            metrics = self._nn["metrics"]
+        else:
+            metrics = [
+                self._nn["available_metrics"][metric] if isinstance(metric, str) else metric
+                for metric in metrics if not isinstance(metric, str) or metric in self._nn["available_metrics"]
+            ]
+        if not metrics:
+            metrics = [NN._acc]
+        _t = time.time()
+        float_logs = self._nn.evaluate(x, y, list(metrics))
+        float_time, _t = time.time() - _t, time.time()
+        y_pred = self.predict(x)
+        q_time = time.time() - _t
+        q_logs = [metric(y, y_pred) for metric in metrics]
+        print()
+        print("=" * 63)
+        print("{:<16s} {:>14s} {:>14s} {:>14s}".format("Metric", "float", "int{}".format(self._n_bits), "delta"))
+        print("-" * 63)
+        for metric, float_log, q_log in zip(metrics, float_logs, q_logs):
+            print("{:<16s} {:14.8} {:14.8} {:14.8}".format(metric.__name__, float_log, q_log, q_log - float_log))
+        print("{:<16s} {:14.8} {:14.8} {:14.8}".format("time (s)", float_time, q_time, q_time - float_time))
+        print("{:<16s} {:>14d} {:>14d}".format("size (bytes)", self.float_nbytes, self.nbytes))
+        print("=" * 63)
+        return float_logs, q_logs
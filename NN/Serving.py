@@ -0,0 +1,380 @@
+import sys
+import json
+import time
+import queue
+import asyncio
+import threading
+import socketserver
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def get_network():
+    try:
+        from TF.Networks import NNDist
+        return NNDist
+    except ImportError:
+        from Basic.Networks import NN
+        return NN
+
+
+# Batching
+
+class _Request:
+
+    def __init__(self, x):
+        self.x = x
+        self.y = self.error = None
+        self.t = time.time()
+        self.done = threading.Event()
+
+
+class ModelBatcher:
+    """
+        Queue incoming rows of one model and coalesce them into batches,
+        which are bounded by max_batch_size (rows) and max_wait (seconds),
+        before running model's '_get_prediction'
+    """
+
+    def __init__(self, model, max_batch_size=256, max_wait=0.005, input_shape=None):
+        """
+        :param input_shape: shape of one row (e.g. (n_features,)), requests of other shapes are rejected
+                            before they are queued. Requests are batched per row shape anyway
+        """
+        self._model = model
+        self._max_batch_size, self._max_wait = max_batch_size, max_wait
+        self._input_shape = None if input_shape is None else tuple(input_shape)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0, "rows": 0, "batches": 0,
+            "total_latency": 0, "max_latency": 0, "busy_time": 0
+        }
+        self._start_time = time.time()
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        elapsed = time.time() - self._start_time
+        n_requests, n_batches = max(1, counters["requests"]), max(1, counters["batches"])
+        return {
+            "requests": counters["requests"],
+            "rows": counters["rows"],
+            "batches": counters["batches"],
+            "avg_batch_size": counters["rows"] / n_batches,
+            "avg_latency_ms": 1000 * counters["total_latency"] / n_requests,
+            "max_latency_ms": 1000 * counters["max_latency"],
+            "throughput_rows_per_s": counters["rows"] / elapsed if elapsed > 0 else 0,
+            "busy_ratio": counters["busy_time"] / elapsed if elapsed > 0 else 0
+        }
+
+    def predict(self, x):
+        x = np.array(x, dtype=np.float64)
+        if len(x.shape) == 1:
+            x = x.reshape(1, -1)
+        if self._input_shape is not None and x.shape[1:] != self._input_shape:
+            raise ValueError("Row shape {} does not match input shape {}".format(x.shape[1:], self._input_shape))
+        request = _Request(x)
+        # Checked under the lock, so that no request is queued after the closing sentinel
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("batcher closed")
+            self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.y
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        request = self._queue.get()
+        if request is None:
+            return []
+        batch, n_rows = [request], len(request.x)
+        deadline = time.time() + self._max_wait
+        while n_rows < self._max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._running = False
+                break
+            batch.append(request)
+            n_rows += len(request.x)
+        return batch
+
+    def _run(self, batch):
+        """ One model call over requests whose rows share one shape, so a malformed request only fails itself """
+        try:
+            y_pred = self._model["get_prediction"](np.vstack([request.x for request in batch]), verbose=0)
+        except Exception as err:
+            for request in batch:
+                request.error = err
+            return
+        count = 0
+        for request in batch:
+            request.y = y_pred[count:count + len(request.x)]
+            count += len(request.x)
+
+    def _loop(self):
+        while self._running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            _t = time.time()
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.x.shape[1:], []).append(request)
+            for group in groups.values():
+                self._run(group)
+            _t_end = time.time()
+            latencies = []
+            for request in batch:
+                latencies.append(_t_end - request.t)
+                request.done.set()
+            with self._lock:
+                self._counters["requests"] += len(batch)
+                self._counters["rows"] += sum([len(request.x) for request in batch])
+                self._counters["batches"] += 1
+                self._counters["total_latency"] += sum(latencies)
+                self._counters["max_latency"] = max(self._counters["max_latency"], max(latencies))
+                self._counters["busy_time"] += _t_end - _t
+        self._fail_queued(RuntimeError("batcher closed"))
+
+    def _fail_queued(self, err):
+        """ Requests left in the queue when the loop stops would otherwise wait forever """
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request.error = err
+                request.done.set()
+
+
+class AsyncPredictor:
+    """
+        asyncio-native request coalescer
+        Concurrent 'await predict(row)' calls are gathered over a short window into one vectorized
+        'model.predict' call, which is run in an executor off the event loop
+        Any model whose 'predict' maps a batch of rows to one result per row works, e.g.
+        NN, CvDBase (ID3Tree, C45Tree) and AdaBoost
+    """
+
+    def __init__(self, model, max_batch_size=256, max_wait=0.002, executor=None, input_shape=None):
+        """
+        :param model:           model which provides 'predict'
+        :param max_batch_size:  a batch is sent as soon as it contains max_batch_size rows
+        :param max_wait:        max seconds the first row of a batch waits for others
+        :param executor:        executor used to run 'predict', a single worker thread by default
+                                (so that calls into one model are serialized)
+        :param input_shape:     shape of one row, rows of other shapes are rejected before they are queued
+                                (rows are batched per shape anyway)
+        """
+        self._model = model
+        self._max_batch_size, self._max_wait = max_batch_size, max_wait
+        self._input_shape = None if input_shape is None else tuple(input_shape)
+        self._own_executor = executor is None
+        self._executor = ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self._pending, self._flush_handle = [], None
+        self._closed = False
+
+    async def predict(self, row):
+        if self._closed:
+            raise RuntimeError("predictor closed")
+        row = np.asarray(row)
+        if self._input_shape is not None and row.shape != self._input_shape:
+            raise ValueError("Row shape {} does not match input shape {}".format(row.shape, self._input_shape))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self._max_batch_size:
+            self._flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_wait, self._flush, loop)
+        return await future
+
+    def close(self):
+        """ Rows which are not sent to the executor yet fail, batches already sent are finished """
+        self._closed = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("predictor closed"))
+        if self._own_executor:
+            self._executor.shutdown()
+
+    def _flush(self, loop):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        groups = {}
+        for row, future in batch:
+            groups.setdefault(row.shape, []).append((row, future))
+        for group in groups.values():
+            # Errors raised here would be lost in the loop callback & leave every caller waiting
+            try:
+                x = np.array([row for row, _ in group])
+                task = loop.run_in_executor(self._executor, self._model.predict, x)
+            except Exception as err:
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+            task.add_done_callback(lambda _task, _group=group: AsyncPredictor._scatter(_group, _task))
+
+    @staticmethod
+    def _scatter(batch, task):
+        err = task.exception()
+        y_pred = None if err is not None else task.result()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if err is not None:
+                future.set_exception(err)
+            else:
+                future.set_result(y_pred[i])
+
+
+# Server
+
+class _PredictionHandler(BaseHTTPRequestHandler):
+
+    server_version = "NNPredictionServer/0.1"
+
+    def _send(self, code, dic):
+        body = json.dumps(dic).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, self.server.owner.stats)
+        elif self.path == "/models":
+            self._send(200, {"models": sorted(self.server.owner.batchers)})
+        else:
+            self._send(404, {"error": "Undefined path '{}'".format(self.path)})
+
+    def do_POST(self):
+        if not self.path.startswith("/predict/"):
+            self._send(404, {"error": "Undefined path '{}'".format(self.path)})
+            return
+        name = self.path[len("/predict/"):]
+        batcher = self.server.owner.batchers.get(name)
+        if batcher is None:
+            self._send(404, {"error": "Model '{}' not found".format(name)})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            x = json.loads(self.rfile.read(length).decode("utf-8"))["x"]
+            y_pred = batcher.predict(x)
+        except (ValueError, KeyError) as err:
+            self._send(400, {"error": "Invalid request ({})".format(err)})
+            return
+        except Exception as err:
+            self._send(500, {"error": "Prediction failed ({})".format(err)})
+            return
+        self._send(200, {"y": y_pred.tolist(), "classes": np.argmax(y_pred, axis=1).tolist()})
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+
+    request_queue_size = 128
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class PredictionServer:
+    """
+        Local prediction server over HTTP (address = (host, port)) or a Unix socket (address = path)
+            POST /predict/<model>   body: {"x": row or rows}  ->  {"y": predictions, "classes": arg max}
+            GET  /stats                                        ->  per-model latency & throughput counters
+            GET  /models                                       ->  names of loaded models
+    """
+
+    def __init__(self, models, address=("127.0.0.1", 8000), max_batch_size=256, max_wait=0.005):
+        """
+        :param models:          dict -> {name: path of a saved model, or a fitted network}
+        :param address:         (host, port) for HTTP, or path of a Unix socket
+        :param max_batch_size:  max rows per coalesced batch
+        :param max_wait:        max seconds to wait for a batch to fill up
+        """
+        self.batchers = {
+            name: ModelBatcher(self._load_model(model), max_batch_size, max_wait)
+            for name, model in models.items()
+        }
+        if isinstance(address, str):
+            self._server = _UnixHTTPServer(address, _PredictionHandler)
+        else:
+            self._server = _HTTPServer(address, _PredictionHandler)
+        self._server.owner = self
+
+    @staticmethod
+    def _load_model(model):
+        if not isinstance(model, str):
+            return model
+        nn = get_network()()
+        nn.load(model)
+        return nn
+
+    @property
+    def stats(self):
+        return {name: batcher.stats for name, batcher in self.batchers.items()}
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+
+if __name__ == '__main__':
+    # Usage: python Serving.py name=Models/Model.nn [name=path ...] [host:port | unix_socket_path]
+    _models, _address = {}, ("127.0.0.1", 8000)
+    for _arg in sys.argv[1:]:
+        if "=" in _arg:
+            _name, _path = _arg.split("=", 1)
+            _models[_name] = _path
+        elif ":" in _arg:
+            _host, _port = _arg.rsplit(":", 1)
+            _address = (_host, int(_port))
+        else:
+            _address = _arg
+    _server = PredictionServer(_models, _address)
+    print("Serving {} at {}".format(", ".join(sorted(_models)), _address))
+    try:
+        _server.serve_forever()
+    except KeyboardInterrupt:
+        _server.shutdown()